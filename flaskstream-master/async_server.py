@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import sys, getopt
+import os
+import asyncio
+import time
+import threading
+import json
+import socket
+from robot import Robot
+from overlay_feed import overlay_events
+
+USAGE = "async_server.py -p <port>"
+BOUNDARY = b"--frame"
+STREAM_HEADERS = (b"HTTP/1.0 200 OK\r\n"
+                  b"Cache-Control: no-cache\r\n"
+                  b"Connection: close\r\n"
+                  b"Content-Type: multipart/x-mixed-replace; boundary=--frame\r\n\r\n")
+EVENT_STREAM_HEADERS = (b"HTTP/1.0 200 OK\r\n"
+                        b"Cache-Control: no-cache\r\n"
+                        b"Connection: close\r\n"
+                        b"Content-Type: text/event-stream\r\n\r\n")
+#the same page server.py renders - it draws the /overlay feed over the stream
+with open(os.path.join(sys.path[0], "templates", "index.html"), "rb") as index_file:
+    INDEX_PAGE = index_file.read()
+#keep no more than about one frame queued per viewer - a slow viewer skips frames instead
+WRITE_BUFFER_HIGH_WATER = 64 * 1024
+#the kernel's own send buffer is capped too, otherwise it soaks up seconds of video on a slow link
+#before the transport (and DeliveryMeter) ever sees any back pressure
+SOCKET_SEND_BUFFER = 64 * 1024
+SEND_WINDOW_SECONDS = 0.5
+
+
+def multipart_part(frame):
+    header = "{}\r\nContent-Type: image/jpeg\r\nContent-length: {}\r\n\r\n".format(BOUNDARY.decode("utf-8"), len(frame)).encode("utf-8")
+    return header + frame + b"\r\n"
+
+
+class MjpegBroadcast:
+    """The current multipart part, shared by every connected viewer
+
+    The part (headers + jpeg) is built once per frame.  Viewers wait on a future that is
+    resolved when the next part arrives; a viewer that is still sending an older part
+    just picks up whatever is current when it's done.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.part = None
+        self.camera = None
+        self.frame = None
+        self.sequence = 0
+        self.next_part = loop.create_future()
+        self.viewers = 0
+
+    def publish(self, part, camera, frame):
+        self.part = part
+        self.camera = camera
+        self.frame = frame
+        self.sequence += 1
+        waiting = self.next_part
+        self.next_part = self.loop.create_future()
+        waiting.set_result(None)
+
+    async def wait_newer(self, last_sequence):
+        while self.sequence <= last_sequence:
+            await asyncio.shield(self.next_part)
+        return self.sequence, self.part, self.camera, self.frame
+
+
+class DeliveryMeter:
+    """How fast one viewer's connection is really taking the stream
+
+    drain() returns as soon as the transport's buffer is under the high water mark, so
+    timing writes says nothing about the link.  Instead the bytes that have left the
+    transport (written minus still buffered) are counted over SEND_WINDOW_SECONDS.  A
+    window only counts if the viewer was backed up in it - a write the socket couldn't
+    take all of, because the kernel's buffer was full.  A viewer that keeps up just shows
+    how fast frames are made, not how much more its link could take.
+    """
+    def __init__(self, transport):
+        self.transport = transport
+        self.written = 0
+        self.window_start = time.monotonic()
+        self.window_sent = 0
+        self.backed_up = False
+
+    #call right after writing size bytes - the transport has already tried to send them
+    def wrote(self, size):
+        self.written += size
+        if self.transport.get_write_buffer_size() > 0:
+            self.backed_up = True
+
+    #returns (bytes, seconds) when a window ends in which the viewer was backed up, otherwise None
+    def sample(self):
+        now = time.monotonic()
+        if now - self.window_start < SEND_WINDOW_SECONDS:
+            return None
+        sent = self.written - self.transport.get_write_buffer_size()
+        size, seconds = sent - self.window_sent, now - self.window_start
+        backed_up = self.backed_up
+        self.window_start = now
+        self.window_sent = sent
+        self.backed_up = False
+        if not backed_up:
+            return None
+        return size, seconds
+
+
+class MjpegServer:
+    def __init__(self, robot, loop):
+        self.robot = robot
+        self.loop = loop
+        self.broadcast = MjpegBroadcast(loop)
+        self.viewers_present = threading.Event()
+
+    def start_frame_bridge(self):
+        bridge = threading.Thread(target=self._frame_bridge)
+        bridge.daemon = True
+        bridge.start()
+
+    #runs on its own thread: follows the live camera and hands each new frame to the event loop.
+    #it only subscribes while someone is watching, so an unwatched camera doesn't encode
+    def _frame_bridge(self):
+        camera = None
+        subscription = None
+        while True:
+            if not self.viewers_present.is_set():
+                if subscription is not None:
+                    subscription.close()
+                    camera = None
+                    subscription = None
+                self.viewers_present.wait()
+            if self.robot.live_camera is not camera:
+                if subscription is not None:
+                    subscription.close()
+                camera = self.robot.live_camera
+                subscription = camera.subscribe()
+            frame = subscription.next_frame(timeout=1.0)
+            if frame is None:
+                continue
+            self.loop.call_soon_threadsafe(self.broadcast.publish, multipart_part(frame.jpeg), camera, frame)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  #headers are ignored
+            parts = request_line.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else "/"
+            if path == "/stream":
+                await self.stream_to(writer)
+            elif path == "/":
+                await self.respond(writer, b"text/html", INDEX_PAGE)
+            elif path == "/overlay":
+                await self.overlay_to(writer)
+            elif path == "/view":
+                await self.respond(writer, b"application/json", json.dumps(self.robot.view_settings()).encode("utf-8"))
+            else:
+                writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, content_type, body):
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: " + content_type + b"\r\nContent-Length: " +
+                     str(len(body)).encode("utf-8") + b"\r\n\r\n" + body)
+        await writer.drain()
+
+    #overlay_events blocks on the camera, so each step of it runs on the default executor
+    async def overlay_to(self, writer):
+        writer.write(EVENT_STREAM_HEADERS)
+        events = overlay_events(self.robot)
+        try:
+            while True:
+                message = await self.loop.run_in_executor(None, next, events)
+                writer.write(message.encode("utf-8"))
+                await writer.drain()
+        finally:
+            events.close()
+
+    async def stream_to(self, writer):
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH_WATER)
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SEND_BUFFER)
+        writer.write(STREAM_HEADERS)
+        self.broadcast.viewers += 1
+        self.viewers_present.set()
+        meter = DeliveryMeter(writer.transport)
+        try:
+            last_sequence = 0
+            while True:
+                last_sequence, part, camera, frame = await self.broadcast.wait_newer(last_sequence)
+                started = time.perf_counter()
+                writer.write(part)
+                meter.wrote(len(part))
+                await writer.drain()
+                camera.metrics.for_frame(frame).record("client_write", time.perf_counter() - started)
+                sample = meter.sample()
+                if sample is not None:
+                    camera.stream_controller.record_send(*sample)
+        finally:
+            self.broadcast.viewers -= 1
+            if self.broadcast.viewers == 0:
+                self.viewers_present.clear()
+
+
+def main(argv):
+    port = 1180
+    try:
+        opts, args = getopt.getopt(argv, "hp:")
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(USAGE)
+            sys.exit(2)
+        elif opt == "-p":
+            port = int(arg)
+
+    robot = Robot()
+    robot.startup()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = MjpegServer(robot, loop)
+    server.start_frame_bridge()
+    loop.run_until_complete(asyncio.start_server(server.handle_connection, "0.0.0.0", port))
+    print("streaming on port {}".format(port))
+    loop.run_forever()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import sys, getopt
+import os
+import itertools
+import time
+import contextlib
+import multiprocessing
+import numpy as np
+import cv2
+import yaml
+from vision.image_analyzer import ImageAnalyzer
+from vision.vision_settings import VisionSettings, DEFAULTS
+from benchmark_snapshots import load_frames, normalize_stats, synthetic_frames
+
+USAGE = ("autotune.py [-d <snapshot_dir> -l <labels.yml> | -s <synthetic_frames>] [-g <grid.yml>] [-c <config.yml>] "
+         "[-j <processes>] [-o <tuned.yml>] [-w]")
+
+#every combination of these is tried - override any of them with -g grid.yml
+GRID = {
+    "blur": [True, False],
+    "rgb_filter": [[0, 255, 180, 255, 0, 255], [0, 255, 200, 255, 0, 255], [0, 255, 218, 255, 0, 255], [0, 255, 235, 255, 0, 255]],
+    "morph_iterations": [0, 1, 2, 3],  #erode N then dilate N
+    "min_area": [50, 75, 150],
+    "angle_error_factor": [5.0, 10.0, 15.0],
+}
+HEADING_TOLERANCE_DEGREES = 1.0
+DISTANCE_TOLERANCE = 0.1  #fraction of the labeled distance
+
+#set in each worker process by _init_worker, so the frames are sent to each worker once instead of with every task
+_frames = None
+_labels = None
+
+
+def pipeline_text(blur, rgb_filter, morph_iterations):
+    lines = []
+    if blur:
+        lines.append("gaussian_blur")
+    lines.append("rgb_filter {}".format(" ".join(str(bound) for bound in rgb_filter)))
+    if morph_iterations > 0:
+        lines.append("erode {}".format(morph_iterations))
+        lines.append("dilate {}".format(morph_iterations))
+    return "\n".join(lines) + "\n"
+
+
+#returns a vision config (as in the config.yml vision section) for every combination in the grid
+def grid_configs(grid, base_config):
+    keys = sorted(grid.keys())
+    configs = []
+    for values in itertools.product(*[grid[key] for key in keys]):
+        point = dict(zip(keys, values))
+        config = dict(base_config)
+        config["pipeline"] = pipeline_text(point["blur"], point["rgb_filter"], point["morph_iterations"])
+        config["min_area"] = point["min_area"]
+        config["angle_error_factor"] = point["angle_error_factor"]
+        configs.append(config)
+    return configs
+
+
+def load_labels(labels_file):
+    with open(labels_file, "r") as f:
+        return yaml.safe_load(f) or {}
+
+
+#labels for synthetic frames come straight from what was rendered
+def synthetic_labels(truths):
+    return {name: {"match": True, "heading": truth["heading"], "distance": truth["distance"]} for name, truth in truths.items()}
+
+
+#a frame is right if the match was found (or correctly not found) and the heading and target gap distance
+#are within tolerance of the label.  Labels without a heading or distance aren't checked for it.
+def frame_is_correct(stats, label):
+    if stats[0] != bool(label.get("match", False)):
+        return False
+    if not stats[0]:
+        return True
+    if label.get("heading") is not None and abs(stats[3] - label["heading"]) > HEADING_TOLERANCE_DEGREES:
+        return False
+    if label.get("distance") is not None and abs(stats[4] - label["distance"]) > DISTANCE_TOLERANCE * label["distance"]:
+        return False
+    return True
+
+
+def _init_worker(frames, labels):
+    global _frames, _labels
+    cv2.setNumThreads(1)  #the pool provides the parallelism, and costs are per core
+    _frames = frames
+    _labels = labels
+
+
+def evaluate(config):
+    settings = VisionSettings(config)
+    correct = 0
+    seconds = 0.0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  #TargetAnalyzer is chatty
+        for name, frame in _frames:
+            image = frame.copy()  #the analyzer draws on the image it's given
+            start = time.perf_counter()
+            _, stats, _, _ = ImageAnalyzer.run(image, "front", settings=settings)
+            seconds += time.perf_counter() - start
+            if frame_is_correct(normalize_stats(stats), _labels[name]):
+                correct += 1
+    return {"config": config, "accuracy": float(correct) / len(_frames), "cost_ms": 1000.0 * seconds / len(_frames)}
+
+
+#the results no other result beats on both accuracy and cost, cheapest first
+def pareto_front(results):
+    front = []
+    for result in sorted(results, key=lambda r: (r["cost_ms"], -r["accuracy"])):
+        if len(front) == 0 or result["accuracy"] > front[-1]["accuracy"]:
+            front.append(result)
+    return front
+
+
+def report(results, front):
+    print("Evaluated {} configurations".format(len(results)))
+    print("Pareto front (cheapest first):")
+    print("{:>9} {:>9}  {}".format("accuracy", "ms/frame", "settings"))
+    for result in front:
+        config = result["config"]
+        print("{:>8.1f}% {:>9.3f}  {} | min_area {} | angle_error_factor {}".format(
+            100.0 * result["accuracy"], result["cost_ms"], "; ".join(config["pipeline"].split("\n")).strip("; "),
+            config["min_area"], config["angle_error_factor"]))
+
+
+#one YAML document per configuration, each a vision section ready to paste into config.yml
+def write_tuned(front, tuned_file):
+    with open(tuned_file, "w") as f:
+        for result in reversed(front):  #most accurate first
+            config = result["config"]
+            f.write("---\n#accuracy {:.1f}%, {:.3f} ms per frame\n".format(100.0 * result["accuracy"], result["cost_ms"]))
+            f.write("vision:\n  pipeline: |\n")
+            for line in config["pipeline"].strip().split("\n"):
+                f.write("    {}\n".format(line))
+            for key in sorted(config.keys()):
+                if key != "pipeline":
+                    f.write("  {}: {}\n".format(key, config[key]))
+    print("Wrote {} configurations to {}".format(len(front), tuned_file))
+
+
+#starts a labels file from what the current settings find - check and correct it by hand
+def write_labels(frames, labels_file, settings):
+    labels = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name, frame in frames:
+            stats = normalize_stats(ImageAnalyzer.run(frame.copy(), "front", settings=settings)[1])
+            labels[name] = {"match": stats[0], "heading": stats[3], "distance": stats[4]} if stats[0] else {"match": False}
+    with open(labels_file, "w") as f:
+        yaml.safe_dump(labels, f, default_flow_style=False)
+    print("Wrote labels for {} frames to {}".format(len(labels), labels_file))
+
+
+def main(argv):
+    snapshot_dir = "../snapshots"
+    labels_file = None
+    synthetic_count = 0
+    grid = dict(GRID)
+    base_config = dict(DEFAULTS)
+    processes = None  #all cores
+    tuned_file = "tuned.yml"
+    write_label_file = False
+
+    try:
+        opts, args = getopt.getopt(argv, "hd:l:s:g:c:j:o:w")
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(USAGE)
+            sys.exit(2)
+        elif opt == "-d":
+            snapshot_dir = arg
+        elif opt == "-l":
+            labels_file = arg
+        elif opt == "-s":
+            synthetic_count = int(arg)
+        elif opt == "-g":
+            with open(arg, "r") as f:
+                grid.update(yaml.safe_load(f) or {})
+        elif opt == "-c":
+            with open(arg, "r") as f:
+                base_config.update(yaml.safe_load(f).get("vision") or {})
+        elif opt == "-j":
+            processes = int(arg)
+        elif opt == "-o":
+            tuned_file = arg
+        elif opt == "-w":
+            write_label_file = True
+
+    if synthetic_count > 0:
+        frames, truths = synthetic_frames(synthetic_count)
+        labels = synthetic_labels(truths)
+    else:
+        frames = load_frames(snapshot_dir)
+        if labels_file is None:
+            print(USAGE)
+            sys.exit(2)
+        if write_label_file:
+            write_labels(frames, labels_file, VisionSettings.from_config(base_config))
+            return
+        labels = load_labels(labels_file)
+        frames = [(name, frame) for name, frame in frames if name in labels]
+    if len(frames) == 0:
+        print("No labeled frames to tune on")
+        sys.exit(2)
+
+    configs = grid_configs(grid, base_config)
+    print("Tuning {} configurations on {} frames".format(len(configs), len(frames)))
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(frames, labels))
+    try:
+        results = pool.map(evaluate, configs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    front = pareto_front(results)
+    report(results, front)
+    write_tuned(front, tuned_file)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,113 @@
+import time
+import threading
+from collections import deque
+
+ADJUST_INTERVAL_SECONDS = 0.5
+QUALITY_STEP = 5
+SCALE_STEP = 0.85
+FPS_STEP = 2
+#only step back up once the stream is comfortably under budget, so it doesn't oscillate
+HEADROOM = 0.75
+SEND_RATE_SECONDS = 2.0  #how long a viewer's measured delivery rate counts - longer than a measuring window
+
+
+class BandwidthController:
+    """Keeps one camera's stream under a bits-per-second budget
+
+    The encoder reports each encoded frame size, and viewers whose connection can't keep
+    up report the rate it actually delivered (see async_server.DeliveryMeter - the flask
+    server can't see its sockets, so it streams on the budget alone).  Every
+    ADJUST_INTERVAL_SECONDS the expected stream rate (average frame size x frame rate x
+    viewers) is compared against the budget - or against what the slowest backed up viewer
+    managed in the last SEND_RATE_SECONDS, if that is lower.  Over budget, quality is
+    lowered first, then scale, then frame rate; under budget they come back in the
+    reverse order.  With a budget of 0 the stream stays at the starting quality and
+    scale, at full frame rate.
+    """
+    def __init__(self, budget_bps, quality, scale, quality_range=(15, 60), scale_range=(0.25, 0.5), fps_range=(5, 20)):
+        self.budget_bps = budget_bps
+        self.quality_min, self.quality_max = quality_range
+        self.scale_min, self.scale_max = scale_range
+        self.fps_min, self.fps_max = fps_range
+        self.quality = quality
+        self.scale = scale
+        self.fps = self.fps_max
+        self.frame_sizes = deque(maxlen=30)
+        self.viewers = 1
+        self.send_rates = deque(maxlen=30)
+        self.last_encode = 0.0
+        self.last_adjust = time.monotonic()
+        self.lock = threading.Lock()
+
+    def is_adaptive(self):
+        return self.budget_bps > 0
+
+    #frame pacing: False means skip this frame to hold the current output frame rate
+    def should_encode(self):
+        if not self.is_adaptive():
+            return True
+        return time.monotonic() - self.last_encode >= 1.0 / self.fps
+
+    def record_encoded(self, size, viewers=1):
+        now = time.monotonic()
+        self.last_encode = now
+        self.frame_sizes.append(size)
+        self.viewers = max(1, viewers)
+        if self.is_adaptive() and now - self.last_adjust >= ADJUST_INTERVAL_SECONDS:
+            self.last_adjust = now
+            self.adjust()
+
+    #called by viewers with the bytes their connection delivered over seconds while it was backed up
+    def record_send(self, size, seconds):
+        if seconds > 0:
+            self.send_rates.append((time.monotonic(), size * 8.0 / seconds))
+
+    def target_bps(self):
+        oldest = time.monotonic() - SEND_RATE_SECONDS
+        rates = [rate for when, rate in list(self.send_rates) if when >= oldest]
+        if len(rates) == 0:
+            return self.budget_bps
+        return min(self.budget_bps, min(rates) * self.viewers)
+
+    def expected_bps(self):
+        sizes = list(self.frame_sizes)
+        if len(sizes) == 0:
+            return 0.0
+        return 8.0 * sum(sizes) / len(sizes) * self.fps * self.viewers
+
+    def adjust(self):
+        with self.lock:
+            expected = self.expected_bps()
+            target = self.target_bps()
+            if expected > target:
+                self._step_down()
+            elif expected < target * HEADROOM:
+                self._step_up()
+            #sizes are re-measured at the new settings - delivery rates belong to the link, so they just age out
+            self.frame_sizes.clear()
+
+    def _step_down(self):
+        if self.quality > self.quality_min:
+            self.quality = max(self.quality_min, self.quality - QUALITY_STEP)
+        elif self.scale > self.scale_min:
+            self.scale = max(self.scale_min, self.scale * SCALE_STEP)
+        elif self.fps > self.fps_min:
+            self.fps = max(self.fps_min, self.fps - FPS_STEP)
+
+    def _step_up(self):
+        if self.fps < self.fps_max:
+            self.fps = min(self.fps_max, self.fps + FPS_STEP)
+        elif self.scale < self.scale_max:
+            self.scale = min(self.scale_max, self.scale / SCALE_STEP)
+        elif self.quality < self.quality_max:
+            self.quality = min(self.quality_max, self.quality + QUALITY_STEP)
+
+    def snapshot(self):
+        return {
+            "budget_bps": self.budget_bps,
+            "target_bps": self.target_bps(),
+            "expected_bps": self.expected_bps(),
+            "jpeg_quality": self.quality,
+            "scale": self.scale,
+            "fps": self.fps if self.is_adaptive() else None,
+        }
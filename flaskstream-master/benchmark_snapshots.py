@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import sys, getopt
+import os
+import glob
+import json
+import time
+import contextlib
+import numpy as np
+import cv2
+import yaml
+from vision.image_analyzer import ImageAnalyzer
+from vision.stage_timings import StageTimings
+from vision.vision_settings import VisionSettings, DEFAULT_SETTINGS
+from frame_sources import SyntheticTargetSource
+
+USAGE = "benchmark_snapshots.py [-d <snapshot_dir> | -s <synthetic_frames>] -r <repeats> -b <baseline.json> [-w] [-t <tolerance>] [-c <config.yml>] [-p <pyramid_scale>]"
+STAT_NAMES = ["success", "center_x", "top_y", "heading", "distance_target_gap", "distance_vertical_rocket_cargo", "distance_vertical"]
+SYNTHETIC_DISTANCES = [48, 72, 96, 120, 150, 180]
+SYNTHETIC_HEADINGS = [-20, -10, -5, 0, 5, 10, 20]
+SYNTHETIC_NOISE_BLOBS = 10
+
+
+def load_frames(snapshot_dir):
+    files = sorted(glob.glob(os.path.join(snapshot_dir, "snapshot-*-raw.jpg")))
+    frames = []
+    for file in files:
+        frame = cv2.imread(file)
+        if frame is None:
+            print("Skipping unreadable snapshot {}".format(file))
+            continue
+        frames.append((os.path.basename(file), frame))
+    return frames
+
+
+#renders count frames of target pairs at known distances and headings - returns the frames and {name: truth}
+def synthetic_frames(count, width=640, height=480):
+    source = SyntheticTargetSource(width, height, 0, SYNTHETIC_DISTANCES, SYNTHETIC_HEADINGS, SYNTHETIC_NOISE_BLOBS)
+    frames = []
+    truths = {}
+    for i in range(count):
+        _, frame = source.read()
+        name = "synthetic-{:04d}".format(i)
+        frames.append((name, frame))
+        truths[name] = source.truth
+    return frames, truths
+
+
+def normalize_stats(stats):
+    #stats come back with a mix of python and numpy numbers - make them comparable and json friendly
+    values = [bool(stats[0])]
+    for value in stats[1:]:
+        values.append(None if value is None else float(value))
+    return values
+
+
+def percentile_ms(samples, pct):
+    return float(np.percentile(samples, pct)) * 1000.0
+
+
+def load_settings(config_file):
+    with open(config_file, "r") as ymlfile:
+        return VisionSettings.from_config(yaml.safe_load(ymlfile).get("vision"))
+
+
+def run_benchmark(frames, repeats, settings=DEFAULT_SETTINGS):
+    timings = StageTimings()
+    latencies = []
+    results = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  #TargetAnalyzer is chatty
+        wall_start = time.perf_counter()
+        for _ in range(repeats):
+            for name, frame in frames:
+                image = frame.copy()  #the analyzer draws on the image it's given
+                start = time.perf_counter()
+                _, stats, _, _ = ImageAnalyzer.run(image, "front", timings, settings=settings)
+                latencies.append(time.perf_counter() - start)
+                results[name] = normalize_stats(stats)
+        wall_time = time.perf_counter() - wall_start
+    return results, latencies, timings, wall_time
+
+
+def report(latencies, timings, wall_time):
+    print("Frames analyzed: {}".format(len(latencies)))
+    print("Throughput: {:.1f} fps".format(len(latencies) / wall_time))
+    print("Latency p50: {:.2f} ms  p95: {:.2f} ms  p99: {:.2f} ms".format(
+        percentile_ms(latencies, 50), percentile_ms(latencies, 95), percentile_ms(latencies, 99)))
+    print("{:<34} {:>10} {:>10} {:>10}".format("Stage", "mean ms", "p95 ms", "total %"))
+    total = sum(latencies)
+    for stage in timings.stages():
+        samples = timings.samples[stage]
+        print("{:<34} {:>10.3f} {:>10.3f} {:>9.1f}%".format(
+            stage, float(np.mean(samples)) * 1000.0, percentile_ms(samples, 95), 100.0 * sum(samples) / total))
+
+
+def report_accuracy(results, truths):
+    found = [name for name in truths if results[name][0]]
+    print("Targets found: {} of {} synthetic frames".format(len(found), len(truths)))
+    if len(found) == 0:
+        return
+    heading_errors = [abs(results[name][3] - truths[name]["heading"]) for name in found]
+    gap_errors = [abs(results[name][4] - truths[name]["distance"]) for name in found]
+    vertical_errors = [abs(results[name][6] - truths[name]["distance"]) for name in found]
+    print("Heading error: mean {:.2f} max {:.2f} degrees".format(np.mean(heading_errors), np.max(heading_errors)))
+    print("Distance (target gap) error: mean {:.2f} max {:.2f} inches".format(np.mean(gap_errors), np.max(gap_errors)))
+    print("Distance (vertical) error: mean {:.2f} max {:.2f} inches".format(np.mean(vertical_errors), np.max(vertical_errors)))
+
+
+def stats_match(expected, actual, tolerance):
+    if expected[0] != actual[0] or len(expected) != len(actual):
+        return False
+    for want, got in zip(expected[1:], actual[1:]):
+        if want is None or got is None:
+            if want != got:
+                return False
+        elif abs(want - got) > tolerance:
+            return False
+    return True
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    mismatches = 0
+    for name in sorted(results):
+        if name not in baseline:
+            print("No baseline for {}".format(name))
+            continue
+        expected = baseline[name]
+        actual = results[name]
+        if not stats_match(expected, actual, tolerance):
+            mismatches += 1
+            print("MISMATCH {}".format(name))
+            for stat, want, got in zip(STAT_NAMES, expected, actual):
+                print("    {:<32} baseline: {}  now: {}".format(stat, want, got))
+    return mismatches
+
+
+#runs the frames at full size and at pyramid_scale - returns the number of frames where they disagree
+def compare_pyramid(frames, settings, pyramid_scale, tolerance, truths=None):
+    full_size, _, _, _ = run_benchmark(frames, 1, settings.with_value("pyramid_scale", 1.0))
+    pyramid, _, _, _ = run_benchmark(frames, 1, settings.with_value("pyramid_scale", pyramid_scale))
+    if truths is not None:
+        for distance in SYNTHETIC_DISTANCES:
+            names = [name for name in truths if truths[name]["distance"] == distance]
+            print("{}\": targets found in {} of {} frames at full size, {} with pyramid_scale {}".format(
+                distance, sum(1 for name in names if full_size[name][0]), len(names), sum(1 for name in names if pyramid[name][0]), pyramid_scale))
+    return compare_to_baseline(pyramid, full_size, tolerance)
+
+
+def main(argv):
+    snapshot_dir = "../snapshots"
+    repeats = 3
+    baseline_file = None
+    write_baseline = False
+    tolerance = 0.001
+    settings = DEFAULT_SETTINGS
+    synthetic_count = 0
+    pyramid_scale = None
+
+    try:
+        opts, args = getopt.getopt(argv, "hd:r:b:wt:c:s:p:")
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(USAGE)
+            sys.exit(2)
+        elif opt == "-d":
+            snapshot_dir = arg
+        elif opt == "-r":
+            repeats = int(arg)
+        elif opt == "-b":
+            baseline_file = arg
+        elif opt == "-w":
+            write_baseline = True
+        elif opt == "-t":
+            tolerance = float(arg)
+        elif opt == "-c":
+            settings = load_settings(arg)
+        elif opt == "-s":
+            synthetic_count = int(arg)
+        elif opt == "-p":
+            pyramid_scale = float(arg)
+
+    truths = None
+    if synthetic_count > 0:
+        frames, truths = synthetic_frames(synthetic_count)
+    else:
+        frames = load_frames(snapshot_dir)
+    if len(frames) == 0:
+        print("No snapshot-*-raw.jpg files found in {}".format(snapshot_dir))
+        sys.exit(2)
+
+    results, latencies, timings, wall_time = run_benchmark(frames, repeats, settings)
+    report(latencies, timings, wall_time)
+    if truths is not None:
+        report_accuracy(results, truths)
+
+    if pyramid_scale is not None:
+        mismatches = compare_pyramid(frames, settings, pyramid_scale, tolerance, truths)
+        if mismatches > 0:
+            print("{} of {} frames found different targets with pyramid_scale {}".format(mismatches, len(frames), pyramid_scale))
+            sys.exit(1)
+        print("pyramid_scale {} finds the same targets as full size".format(pyramid_scale))
+
+    if baseline_file is None:
+        return
+    if write_baseline:
+        with open(baseline_file, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Wrote baseline for {} frames to {}".format(len(results), baseline_file))
+        return
+
+    with open(baseline_file, "r") as f:
+        baseline = json.load(f)
+    mismatches = compare_to_baseline(results, baseline, tolerance)
+    if mismatches > 0:
+        print("{} of {} frames changed vision output compared to {}".format(mismatches, len(results), baseline_file))
+        sys.exit(1)
+    print("Vision output matches baseline {}".format(baseline_file))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
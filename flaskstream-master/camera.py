@@ -1,5 +1,4 @@
 import yaml
-import subprocess
 import os
 import sys
 import time
@@ -8,46 +7,18 @@ import threading
 import cv2
 import numpy as np
 from vision.image_analyzer import ImageAnalyzer
-
-try:
-    from greenlet import getcurrent as get_ident
-except ImportError:
-    try:
-        from thread import get_ident
-    except ImportError:
-        from _thread import get_ident
-
-
-class CameraEvent(object):
-    """Used to keep track of threading states for each camera object"""
-    def __init__(self):
-        self.events = {}
-
-    def wait(self):
-        """Invoked by each client's thread to wait for the next frame"""
-        ident = get_ident()
-        if ident not in self.events:
-            self.events[ident] = [threading.Event(), time.time()]
-            return self.events[ident][0].wait()
-
-    def set(self):
-        """Invoked by the client's thread whenever a new frame is available"""
-        now = time.time()
-        remove = None
-        for ident, event in self.events.items():
-            if not event[0].isSet():  #the client's event is not set, so set it
-                event[0].set()
-                event[1] = now
-            else:  #client didn't process a prior frame - if persists for more than 5 sec, assume client is dead
-                if now - event[1] > 5:
-                    remove = ident
-
-        if remove:
-            del self.events[remove]
-
-    def clear(self):
-        """Invoiced from client's thread after a frame is processed"""
-        self.events[get_ident()][0].clear()
+from vision.pipeline_buffers import PipelineBuffers
+from metrics import CameraMetrics
+from frame_broadcaster import FrameBroadcaster
+from camera_frame import CameraFrame
+from frame_buffers import FrameBufferPool
+from vision_worker_pool import VisionWorkerPool
+from bandwidth_controller import BandwidthController
+from vision.target_tracker import TargetTracker
+from vision.camera_calibration import LINEAR_CALIBRATION
+import v4l2
+from flight_recorder import FlightRecorder
+import frame_sources
 
 
 class RobotCamera:
@@ -62,81 +33,254 @@ class RobotCamera:
         self.height = 240
         self.width = 320
         self.fps = 15
+        self.source = None  #a "source" config for frame_sources.open_source, or None for the v4l2 camera itself
+        self.calibration = LINEAR_CALIBRATION  #a CameraCalibration from config.yml if this camera has one
+        self.passthrough = False  #stream the device's own MJPG frames without decoding - see use_passthrough
+        self.passthrough_scale = 1.0  #the stream scale a passthrough camera is opened at, once MJPG is confirmed
         self.thread = None
-        self.frame = None
-        self.event = CameraEvent()
+        self.analysis_thread = None
+        self.encode_thread = None
+        self.vision_pool = None
+        self.tracker = TargetTracker()
+        self.captured = FrameBroadcaster()  #raw CameraFrames from the capture thread
+        self.analyzed = FrameBroadcaster()  #CameraFrames after vision analysis
+        self.broadcaster = FrameBroadcaster()  #encoded jpeg bytes for viewers
+        self.metrics = CameraMetrics(role)
+        self.stream_controller = None
+        self.recorder = None  #FlightRecorder of the vision camera's raw frames and stats, see Robot.dump_flight_recorder
+        self.frame_buffers = None  #FrameBufferPool the capture thread reads into, sized from the first frame
+        self.analysis_buffers = PipelineBuffers()  #only used on the analysis thread
+        self.stream_buffers = {}  #resize and flip outputs, only used on the encode thread
+        self.startup_status = {"ready": False, "error": None}  #per step timings in ms, see /status
 
+    #failures are recorded in startup_status rather than raised, so one bad camera doesn't stop the others
     def start_streaming(self):
-        self._init_thread()
+        start = time.perf_counter()
+        try:
+            self._init_thread()
+        except Exception as error:
+            print(error)
+            self.startup_status["error"] = str(error)
+        self.startup_status["total_ms"] = self._elapsed_ms(start)
+        self.startup_status["ready"] = self.is_ready()
+
+    def is_ready(self):
+        return self.thread is not None and self.thread.is_alive() and self.captured.sequence > 0
+
+    #the worker processes are forked, so call this before any camera threads start.  The slots are sized
+    #from the configured resolution - frames that come back a different size are analyzed on the camera's thread.
+    def start_vision_pool(self):
+        if self.vision_pool is None and self.is_vision_camera() and self.robot.vision_workers > 0:
+            shape = (self.height, self.width, 3)
+            self.vision_pool = VisionWorkerPool(self.role, shape, self.robot.vision_workers, self._publish_analysis, self.metrics, self.calibration)
+
+    #returns a FrameSubscription that yields this camera's CameraFrames once their jpeg is encoded - close it when the viewer goes away
+    def subscribe(self):
+        return self.broadcaster.subscribe()
 
-    def get_frame(self):
-        self.event.wait()
-        self.event.clear()
-        return self.frame
+    #returns a FrameSubscription of analyzed frames (for their overlay and stats), or None if this camera doesn't run vision
+    def subscribe_overlay(self):
+        if not self.is_vision_camera():
+            return None
+        return self.analyzed.subscribe()
 
+    def is_vision_camera(self):
+        return self.role == "front"
+
+    #Streams the camera's compressed frames as they come from the device: nothing is decoded (except for a
+    #snapshot), resized or encoded.  The camera is opened at the stream size instead of resizing, and the
+    #flip is left to the viewer (see Robot.view_settings).  Only for cameras that don't run vision.
+    def use_passthrough(self, scale):
+        if self.is_vision_camera():
+            print("{} camera runs vision - passthrough ignored".format(self.role))
+            return
+        self.passthrough = True
+        self.passthrough_scale = scale
+
+    #Capture, vision analysis and encoding each run on their own thread, connected by broadcasters that
+    #only ever hold the latest frame.  Capture drains the driver at camera rate, and a slow stage just
+    #skips to the newest frame instead of letting stale frames pile up behind it.
     def _init_thread(self):
         if self.thread is None:
-            #start up the background thread for opencv frame processing
-            self.thread = threading.Thread(target=self._thread)
-            self.thread.start()
+            self.stream_controller = self._create_stream_controller()
+            if self.is_vision_camera() and self.robot.flight_recorder_seconds > 0:
+                self.recorder = FlightRecorder(self.robot.flight_recorder_seconds, self.fps)
+            camera = self._open_source()
+            if not camera.isOpened():
+                raise RuntimeError("Could not start camera {}".format(self.linux_device))
 
-            #wait until a frame comes through
-            while self.get_frame() is None:
-                time.sleep(0)
+            #start up the background threads for opencv frame processing
+            self.thread = threading.Thread(target=self._capture_thread, args=(camera,))
+            self.thread.start()
+            if self.is_vision_camera():
+                self.analysis_thread = threading.Thread(target=self._analysis_thread)
+                self.analysis_thread.start()
+            self.encode_thread = threading.Thread(target=self._encode_thread)
+            self.encode_thread.start()
 
-    def _thread(self):
-        frames_iterator = self.frames()
-        for frame in frames_iterator:
-            self.frame = frame
-            self.event.set()
-            time.sleep(0)
+            #wait until a frame is captured (or the thread gives up) - nothing is encoded until someone watches
+            start = time.perf_counter()
+            frame = None
+            while frame is None and self.thread.is_alive():
+                _, frame = self.captured.wait_for_frame(0, timeout=1.0)
+            self.startup_status["first_frame_ms"] = self._elapsed_ms(start)
 
-        self.thread = None
+    #frames are read straight into recycled buffers - the broadcasters and subscriptions hand the
+    #references along, and a buffer goes back to the pool once no stage holds its frame
+    def _capture_thread(self, camera):
+        sequence = 0
+        while True:
+            buffer = None if self.frame_buffers is None else self.frame_buffers.acquire()
+            start = time.perf_counter()
+            grabbed, image = camera.read() if buffer is None else camera.read(buffer.array)
+            seconds = time.perf_counter() - start
+            if buffer is not None and (not grabbed or image is not buffer.array):
+                #nothing read, or the source handed back an array of its own (a different size)
+                buffer.release()
+                buffer = None
+            if not grabbed:
+                self.metrics.record("capture", seconds)
+                self.metrics.mark_dropped()
+                print("unable to grab frame from camera")
+                continue
+            sequence += 1
+            if self.passthrough:
+                #image is the device's jpeg, undecoded
+                frame = CameraFrame(sequence, None)
+                frame.jpeg = image.tobytes()
+            else:
+                if self.frame_buffers is None or self.frame_buffers.shape != image.shape:
+                    self.frame_buffers = FrameBufferPool(image.shape, dtype=image.dtype)
+                frame = CameraFrame(sequence, image, buffer=buffer)
+            self.metrics.for_frame(frame).record("capture", seconds)
+            self.metrics.mark_captured()
+            self.captured.publish(frame)
+            frame.release()  #the broadcaster holds the frame now
 
-    def frames(self):
-        camera = self._get_opencv_camera()
-        if not camera.isOpened():
-            raise RuntimeError("Could not start camera {}".format(self.linux_device))
+    def _analysis_thread(self):
+        with self.captured.subscribe() as subscription:
+            while True:
+                if self.vision_pool is not None:
+                    #wait for a free worker slot first, so the freshest frame is the one that gets submitted
+                    self.vision_pool.wait_for_free_slot()
+                skipped = subscription.skipped_frames
+                frame = subscription.next_frame()
+                self.metrics.mark_dropped(subscription.skipped_frames - skipped)
+                if self.vision_pool is not None and self.vision_pool.submit(frame, self.robot.vision_settings, self.robot.take_snapshot_now):
+                    continue
+                with self.metrics.for_frame(frame).timer("process_frame"):
+                    self._process_frame(frame)
+                self._publish_analysis(frame)
 
-        quality_params = [int(cv2.IMWRITE_JPEG_QUALITY), self.robot.jpeg_quality]
-        while True:
+    def _publish_analysis(self, frame):
+        if frame.stats is not None:
             try:
-                raw_frame, processed_frame, final_frame = self._process_frame(camera)
-
-                stream_frame = cv2.resize(final_frame, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
-                if self.robot.flip_image:
-                    stream_frame = cv2.flip(stream_frame, 1)
-                yield cv2.imencode('.jpg', stream_frame, quality_params)[1].tobytes()
-                if self.robot.take_snapshot_now == True:
-                    self._save_snapshot(raw_frame, "raw")
-                    self._save_snapshot(processed_frame, "processed")
-                    self.robot.take_snapshot_now = False
-            except:
-                print("unable to grab frame from camera")
+                self.robot.send_stats_to_robot(frame.stats, self, frame)
+            except Exception as error:
+                #e.g. the network is unreachable while the robot link is down - keep analyzing and streaming
+                print(error)
+                print("exception in send_stats_to_robot")
+        self.metrics.mark_processed()
+        self.analyzed.publish(frame)
+
+    def _encode_thread(self):
+        #non-vision cameras stream straight from capture
+        source = self.analyzed if self.is_vision_camera() else self.captured
+        controller = self.stream_controller
+        with source.subscribe() as subscription:
+            while True:
+                frame = subscription.next_frame()
+                timings = self.metrics.for_frame(frame)
+                try:
+                    if self.recorder is not None:
+                        with timings.timer("record"):
+                            self.recorder.record(frame)
+                    if self.robot.take_snapshot_now == True:
+                        if self.passthrough:
+                            self._save_snapshot(cv2.imdecode(np.frombuffer(frame.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR), "raw")
+                        else:
+                            self._save_snapshot(np.copy(frame.image), "raw")  #the buffer is recycled once the frame is released
+                        if frame.processed is not None:
+                            self._save_snapshot(frame.processed, "processed")
+                        self.robot.take_snapshot_now = False
+                    #encoding is demand driven - with nobody watching, skip the resize and encode entirely.
+                    #a new viewer gets the very next frame since this loop still wakes for every frame.
+                    if self.broadcaster.subscribers == 0:
+                        continue
+                    if not controller.should_encode():
+                        continue
+                    if not self.passthrough:
+                        self._encode_frame(frame, timings, controller)
+                    self.metrics.mark_encoded()
+                    controller.record_encoded(len(frame.jpeg), self.broadcaster.subscribers)
+                    self.broadcaster.publish(frame)
+                except Exception as error:
+                    self.metrics.mark_dropped()
+                    print(error)
+                    print("unable to encode frame from camera")
+
+    #fills in frame.jpeg - resized for the stream, with the overlay drawn unless viewers draw it, and flipped if asked
+    def _encode_frame(self, frame, timings, controller):
+        scale = controller.scale
+        height, width = frame.image.shape[:2]
+        size = (int(round(width * scale)), int(round(height * scale)))
+        with timings.timer("resize"):
+            stream_frame = cv2.resize(frame.image, size, dst=self._stream_buffer("resize", size, frame.image), interpolation=cv2.INTER_AREA)
+        if frame.overlay is not None and self.robot.draw_overlay:
+            with timings.timer("draw"):
+                frame.overlay.draw(stream_frame)
+        if self.robot.flip_image:
+            stream_frame = cv2.flip(stream_frame, 1, dst=self._stream_buffer("flip", size, frame.image))
+        with timings.timer("encode"):
+            frame.jpeg = cv2.imencode('.jpg', stream_frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(controller.quality)])[1].tobytes()
+
+    def _create_stream_controller(self):
+        settings = self.robot.stream_bandwidth
+        return BandwidthController(
+            settings.get("budget_bps", 0),
+            self.robot.jpeg_quality,
+            settings.get("scale", [0.25, 0.5])[1],
+            quality_range=settings.get("quality", [15, 60]),
+            scale_range=settings.get("scale", [0.25, 0.5]),
+            fps_range=settings.get("fps", [5, self.fps]))
 
+    #a reused output image for the encode thread, width x height with the same channels as like
+    def _stream_buffer(self, name, size, like):
+        shape = (size[1], size[0]) + like.shape[2:]
+        array = self.stream_buffers.get(name)
+        if array is None or array.shape != shape or array.dtype != like.dtype:
+            array = np.empty(shape, dtype=like.dtype)
+            self.stream_buffers[name] = array
+        return array
 
+    #queued for the robot's SnapshotWriter - the image must not change afterwards
     def _save_snapshot(self, frame, frametype):
         filename = "../snapshots/snapshot-{}-{}.jpg".format(datetime.now().strftime("%Y%m%d-%H%M%S"), frametype)
-        cv2.imwrite(filename, frame, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+        if not self.robot.snapshot_writer.write(filename, frame):
+            print("snapshot queue is full - dropped {}".format(filename))
 
-    #returns raw_frame, processed_frame, final_frame
-    def _process_frame(self, camera):
-        processed_img = None
-        _, frame = camera.read()
+    #fills in the frame's overlay and stats, and its processed image if a snapshot is about to be taken
+    def _process_frame(self, frame):
         try:
-            if self.role == "front":
-                #Perform OpenCV vision analysis here!
-                original_image, stats, processed_img, img_to_stream = ImageAnalyzer.run(frame, self.role)
-                self.robot.send_stats_to_robot(stats, self)
-                img = img_to_stream
-            else:
-                img = frame
-                original_image = frame
-            return original_image, processed_img, img
+            #Perform OpenCV vision analysis here!
+            analyzer = ImageAnalyzer(frame.image, self.role, self.metrics.for_frame(frame), self.tracker, self.robot.vision_settings, self.calibration,
+                                     buffers=self.analysis_buffers, annotate=False)
+            _, stats, processed_img, _ = analyzer.execute()
+            if self.robot.take_snapshot_now:
+                frame.processed = np.copy(processed_img)  #processed_img is reused by the next analysis
+            frame.overlay = analyzer.overlay
+            frame.stats = stats
         except Exception as error:
             print(error)
             print("exception in _process_frame")
-            return frame, None, frame
+
+    def _open_source(self):
+        if self.source is None or self.source.get("type", "v4l2") == "v4l2":
+            return self._get_opencv_camera()
+        if self.passthrough:
+            print("{} camera source {} has no compressed frames - passthrough off".format(self.role, self.source.get("type")))
+            self.passthrough = False
+        return frame_sources.open_source(self.source, self.width, self.height, self.fps)
 
     def _get_opencv_camera(self):
         ndx = int(self.camera_index)
@@ -148,21 +292,54 @@ class RobotCamera:
             'contrast': 112,
             'white_balance_temperature_auto': 0 #off
         }
+        start = time.perf_counter()
         self._set_camera_properties(props)
         self._set_fps(self.fps)
+        self.startup_status["configure_ms"] = self._elapsed_ms(start)
 
-        subprocess.call(['v4l2-ctl -d /dev/video1 -l'], shell=True)
+        start = time.perf_counter()
         camera = cv2.VideoCapture(ndx)
+        width, height = self.width, self.height
+        if self.passthrough:
+            self._request_mjpg(camera)
+        if self.passthrough:
+            #frames are streamed as captured, so capture at the stream size
+            width = int(round(width * self.passthrough_scale))
+            height = int(round(height * self.passthrough_scale))
 
         #set camera resolution
-        camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
-        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.startup_status["open_ms"] = self._elapsed_ms(start)
+        self.startup_status["passthrough"] = self.passthrough
 
         return camera
 
+    #MJPG has to be chosen before the resolution.  Without CONVERT_RGB, read() returns the jpeg bytes
+    #the device produced instead of decoding them - if the driver won't do either, fall back to decoding.
+    def _request_mjpg(self, camera):
+        mjpg = cv2.VideoWriter_fourcc(*"MJPG")
+        camera.set(cv2.CAP_PROP_FOURCC, mjpg)
+        camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        if int(camera.get(cv2.CAP_PROP_FOURCC)) != mjpg or camera.get(cv2.CAP_PROP_CONVERT_RGB) != 0:
+            print("{} won't deliver MJPG frames - passthrough off".format(self.linux_device))
+            camera.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            self.passthrough = False
+
     def _set_fps(self, fps):
-        subprocess.call(['v4l2-ctl -d /dev/video{} -p {}'.format(self.camera_index, fps)],shell=True)
+        try:
+            v4l2.set_frame_rate(self.linux_device, fps)
+        except OSError as error:
+            print("unable to set {} to {} fps: {}".format(self.linux_device, fps, error))
 
     def _set_camera_properties(self, camera_properties_hash):
-        for key in camera_properties_hash:
-            subprocess.call(['v4l2-ctl -d /dev/video{} -c {}={}'.format(self.camera_index, key, str(camera_properties_hash[key]))],shell=True)
+        try:
+            failed = v4l2.set_controls(self.linux_device, camera_properties_hash)
+        except OSError as error:
+            print("unable to open {} to set controls: {}".format(self.linux_device, error))
+            return
+        if len(failed) > 0:
+            print("{} rejected controls: {}".format(self.linux_device, ", ".join(failed)))
+
+    def _elapsed_ms(self, start):
+        return round(1000.0 * (time.perf_counter() - start), 1)
@@ -0,0 +1,31 @@
+import time
+
+
+class CameraFrame:
+    """One captured frame and everything the later stages add to it
+
+    image is the raw capture, processed is the vision pipeline's mask (only kept when a
+    snapshot needs it), overlay is the TargetOverlay to draw on the streamed image,
+    stats is what was sent to the robot and jpeg is the encoded stream image.
+
+    image may live in a pooled FrameBuffer - it is never modified once published, and
+    anything that holds on to the frame beyond its broadcaster's latest frame retains
+    it and releases it when done.  Copy image to keep the pixels any longer.
+    """
+    def __init__(self, sequence, image, capture_time=None, buffer=None):
+        self.sequence = sequence
+        self.capture_time = time.monotonic() if capture_time is None else capture_time
+        self.image = image
+        self.buffer = buffer
+        self.processed = None
+        self.overlay = None
+        self.stats = None
+        self.jpeg = None
+
+    def retain(self):
+        if self.buffer is not None:
+            self.buffer.retain()
+
+    def release(self):
+        if self.buffer is not None:
+            self.buffer.release()
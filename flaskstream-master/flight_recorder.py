@@ -0,0 +1,90 @@
+import os
+import threading
+import numpy as np
+import cv2
+
+STAT_COLUMNS = ["success", "center_x", "top_y", "heading", "distance_target_gap", "distance_vertical_rocket_cargo", "distance_vertical"]
+
+
+class FlightRecorder:
+    """Keeps the last few seconds of raw frames and their vision stats in fixed memory
+
+    The ring of image buffers is allocated once, sized from the first frame, and each
+    recorded frame is copied into the oldest slot.  dump() writes the ring out on a
+    background thread while recording carries on - any frame overwritten before the
+    dump reaches it is skipped.
+    """
+    def __init__(self, seconds, fps):
+        self.capacity = max(1, int(round(seconds * fps)))
+        self.images = None
+        self.sequences = [0] * self.capacity
+        self.capture_times = [0.0] * self.capacity
+        self.stats = [None] * self.capacity
+        self.next_slot = 0
+        self.count = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+        self.dump_thread = None
+
+    def record(self, frame):
+        image = frame.image
+        with self.lock:
+            if self.images is None:
+                self.images = np.empty((self.capacity,) + image.shape, dtype=image.dtype)
+            elif image.shape != self.images.shape[1:]:
+                self.skipped += 1
+                return
+            slot = self.next_slot
+            np.copyto(self.images[slot], image)
+            self.sequences[slot] = frame.sequence
+            self.capture_times[slot] = frame.capture_time
+            self.stats[slot] = frame.stats
+            self.next_slot = (slot + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    #starts writing the recorded frames to directory - returns False if a dump is already running
+    def dump(self, directory):
+        if self.dump_thread is not None and self.dump_thread.is_alive():
+            return False
+        self.dump_thread = threading.Thread(target=self._dump_thread, args=(directory,))
+        self.dump_thread.daemon = True
+        self.dump_thread.start()
+        return True
+
+    def snapshot(self):
+        return {
+            "capacity": self.capacity,
+            "frames": self.count,
+            "skipped": self.skipped,
+            "dumping": self.dump_thread is not None and self.dump_thread.is_alive(),
+        }
+
+    def _dump_thread(self, directory):
+        with self.lock:
+            if self.images is None:
+                return
+            first = (self.next_slot - self.count) % self.capacity
+            entries = [((first + i) % self.capacity, self.sequences[(first + i) % self.capacity]) for i in range(self.count)]
+            scratch = np.empty_like(self.images[0])
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        lost = 0
+        with open(os.path.join(directory, "stats.csv"), "w") as stats_file:
+            stats_file.write("sequence,capture_time,{}\n".format(",".join(STAT_COLUMNS)))
+            for slot, sequence in entries:
+                with self.lock:
+                    if self.sequences[slot] != sequence:
+                        lost += 1
+                        continue
+                    np.copyto(scratch, self.images[slot])
+                    capture_time, stats = self.capture_times[slot], self.stats[slot]
+                cv2.imwrite(os.path.join(directory, "frame-{:06d}.jpg".format(sequence)), scratch, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+                stats_file.write("{},{},{}\n".format(sequence, capture_time, self._format_stats(stats)))
+        print("flight recorder wrote {} frames to {} ({} overwritten before they were written)".format(len(entries) - lost, directory, lost))
+
+    def _format_stats(self, stats):
+        if stats is None:
+            return ",".join([""] * len(STAT_COLUMNS))
+        values = [1 if stats[0] else 0] + ["" if value is None else value for value in stats[1:]]
+        return ",".join(str(value) for value in values)
@@ -0,0 +1,93 @@
+import threading
+
+
+class FrameBroadcaster:
+    """Hands the newest frame to any number of waiting viewers
+
+    Every published frame gets the next sequence number.  Viewers remember the last
+    sequence they saw and block on a single condition variable until a newer frame
+    is published, so there is no per-viewer state to set, poll or clean up here.
+    The broadcaster keeps a reference to its latest frame (see CameraFrame.retain).
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.subscribers = 0
+
+    def publish(self, frame):
+        frame.retain()
+        with self.condition:
+            replaced = self.frame
+            self.frame = frame
+            self.sequence += 1
+            self.condition.notify_all()
+        if replaced is not None:
+            replaced.release()
+
+    #returns (sequence, frame), or (last_sequence, None) if nothing newer arrived before the timeout.
+    #with retain set the frame is retained before another publish can release it - the caller releases it
+    def wait_for_frame(self, last_sequence, timeout=None, retain=False):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.sequence > last_sequence, timeout):
+                return last_sequence, None
+            if retain:
+                self.frame.retain()
+            return self.sequence, self.frame
+
+    def subscribe(self):
+        return FrameSubscription(self)
+
+    def _add_subscriber(self):
+        with self.condition:
+            self.subscribers += 1
+
+    def _remove_subscriber(self):
+        with self.condition:
+            self.subscribers -= 1
+
+
+class FrameSubscription:
+    """One viewer's place in a FrameBroadcaster
+
+    Slow viewers never queue frames - each call to next_frame returns the newest frame
+    and the frames that were published in between are skipped and counted.  A new
+    subscription waits for the next frame rather than getting whatever was last published,
+    which may be old if nobody was watching.  The frame returned by next_frame stays
+    retained until the following call to next_frame, or until the subscription is closed.
+    """
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.last_sequence = broadcaster.sequence
+        self.skipped_frames = 0
+        self.closed = False
+        self.frame = None
+        broadcaster._add_subscriber()
+
+    def next_frame(self, timeout=None):
+        sequence, frame = self.broadcaster.wait_for_frame(self.last_sequence, timeout, retain=True)
+        if frame is None:
+            return None
+        self._release_frame()
+        self.frame = frame
+        self.skipped_frames += sequence - self.last_sequence - 1
+        self.last_sequence = sequence
+        return frame
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._release_frame()
+            self.broadcaster._remove_subscriber()
+
+    def _release_frame(self):
+        if self.frame is not None:
+            self.frame.release()
+            self.frame = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,50 @@
+import threading
+import numpy as np
+
+
+class FrameBuffer:
+    """One preallocated image array, handed back to its pool when the last reference is released"""
+    def __init__(self, pool, array):
+        self.pool = pool
+        self.array = array
+        self.references = 0
+
+    def retain(self):
+        with self.pool.lock:
+            self.references += 1
+
+    def release(self):
+        with self.pool.lock:
+            self.references -= 1
+            if self.references == 0:
+                self.pool.free.append(self)
+
+
+class FrameBufferPool:
+    """Image buffers for one camera's captures, recycled instead of allocated per frame
+
+    acquire() returns a buffer holding one reference.  Every stage that keeps the frame
+    past handing it on retains it and releases it when done (FrameBroadcaster and
+    FrameSubscription do this for their frames).  The pool grows rather than making
+    capture wait when every buffer is still in use.
+    """
+    def __init__(self, shape, count=8, dtype=np.uint8):
+        self.shape = shape
+        self.dtype = dtype
+        self.lock = threading.Lock()
+        self.free = [FrameBuffer(self, np.empty(shape, dtype=dtype)) for _ in range(count)]
+        self.allocated = count
+
+    def acquire(self):
+        with self.lock:
+            if len(self.free) > 0:
+                buffer = self.free.pop()
+            else:
+                buffer = FrameBuffer(self, np.empty(self.shape, dtype=self.dtype))
+                self.allocated += 1
+            buffer.references = 1
+            return buffer
+
+    def snapshot(self):
+        with self.lock:
+            return {"allocated": self.allocated, "free": len(self.free)}
@@ -0,0 +1,177 @@
+import os
+import glob
+import itertools
+import math
+import time
+import numpy as np
+import cv2
+from vision.target_analyzer import CAMERA_FOV_WIDTH_DEGREES, CAMERA_FOV_HEIGHT_DEGREES, TARGET_GAP_INCHES, CAMERA_HEIGHT_INCHES, TARGET_HEIGHT_STANDARD_INCHES
+
+#Stand-ins for cv2.VideoCapture, so the capture, vision, streaming and UDP path can run without a camera.
+#RobotCamera only needs isOpened(), read([image]), set() and release().  Pick one per camera with a "source"
+#entry in config.yml - see open_source.
+
+STRIP_WIDTH_INCHES = 2.0
+STRIP_LENGTH_INCHES = 5.5
+STRIP_TILT_DEGREES = 14.5
+STRIP_COLOR = (60, 250, 60)   #BGR, bright green like the ring light on retroreflective tape
+IMAGE_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png")
+
+
+#returns a frame source for a camera's "source" config, e.g. {"type": "synthetic", "distance": [60, 120]}
+def open_source(config, width, height, fps):
+    source_type = config.get("type")
+    rate = config.get("fps", fps)
+    if source_type == "video":
+        return FileSource(config["path"], width, height, rate, config.get("loop", True))
+    if source_type == "synthetic":
+        return SyntheticTargetSource(width, height, rate,
+                                     distances=config.get("distance", 120.0),
+                                     headings=config.get("heading", 0.0),
+                                     noise_blobs=config.get("noise_blobs", 0),
+                                     seed=config.get("seed", 0))
+    raise ValueError("Unknown frame source type: {}".format(source_type))
+
+
+#like VideoCapture.read(image), a frame is copied into the caller's array when it fits, otherwise it's returned as is
+def _read_into(image, frame):
+    if image is None or image.shape != frame.shape or image.dtype != frame.dtype:
+        return frame
+    np.copyto(image, frame)
+    return image
+
+
+class FramePacer:
+    """Sleeps just long enough to hand out frames at fps - 0 means as fast as they are asked for"""
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.next_frame_time = None
+
+    def wait(self):
+        if self.interval == 0.0:
+            return
+        now = time.monotonic()
+        if self.next_frame_time is None or now - self.next_frame_time > self.interval:
+            self.next_frame_time = now  #started, or fell more than a frame behind - don't try to catch up
+        elif self.next_frame_time > now:
+            time.sleep(self.next_frame_time - now)
+        self.next_frame_time += self.interval
+
+
+class FileSource:
+    """Plays a video file, or a directory of images in name order, at a fixed rate
+
+    Frames are resized to the configured camera resolution.  With loop set, playback
+    starts over at the end instead of failing reads the way an unplugged camera would.
+    """
+    def __init__(self, path, width, height, fps, loop=True):
+        self.path = path
+        self.size = (width, height)
+        self.loop = loop
+        self.pacer = FramePacer(fps)
+        self.files = None
+        self.capture = None
+        self.position = 0
+        if os.path.isdir(path):
+            self.files = sorted(itertools.chain.from_iterable(glob.glob(os.path.join(path, pattern)) for pattern in IMAGE_EXTENSIONS))
+        else:
+            self.capture = cv2.VideoCapture(path)
+
+    def isOpened(self):
+        if self.files is not None:
+            return len(self.files) > 0
+        return self.capture.isOpened()
+
+    def read(self, image=None):
+        self.pacer.wait()
+        frame = self._next_image()
+        if frame is None:
+            return False, None
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return True, _read_into(image, frame)
+
+    def set(self, prop, value):
+        return False  #resolution comes from the constructor
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+
+    def _next_image(self):
+        if self.files is not None:
+            if self.position >= len(self.files):
+                if not self.loop:
+                    return None
+                self.position = 0
+            image = cv2.imread(self.files[self.position])
+            self.position += 1
+            return image
+        grabbed, image = self.capture.read()
+        if not grabbed and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            grabbed, image = self.capture.read()
+        return image if grabbed else None
+
+
+class SyntheticTargetSource:
+    """Renders a pair of tilted target strips at known distances and headings
+
+    Each frame uses the next (distance, heading) combination from the configured lists,
+    and truth holds the values used for the last frame read.  The strips are sized and
+    placed with the same field of view model as TargetAnalyzer, so a correct match
+    reports the rendered distance and heading.  noise_blobs adds that many green
+    circles at random spots to give the filters something to reject.
+    """
+    def __init__(self, width, height, fps, distances=120.0, headings=0.0, noise_blobs=0, seed=0):
+        self.width = width
+        self.height = height
+        self.pacer = FramePacer(fps)
+        self.noise_blobs = noise_blobs
+        self.random = np.random.RandomState(seed)
+        self.poses = itertools.cycle(list(itertools.product(self._as_list(distances), self._as_list(headings))))
+        self.truth = None
+        self.left_strip = self._strip_outline(STRIP_TILT_DEGREES, -TARGET_GAP_INCHES / 2.0)
+        self.right_strip = self._strip_outline(-STRIP_TILT_DEGREES, TARGET_GAP_INCHES / 2.0)
+
+    def isOpened(self):
+        return True
+
+    def read(self, image=None):
+        self.pacer.wait()
+        distance, heading = next(self.poses)
+        self.truth = {"distance": distance, "heading": heading}
+        return True, _read_into(image, self.render(distance, heading))
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        pass
+
+    def render(self, distance, heading):
+        image = self.random.randint(0, 80, (self.height, self.width, 3)).astype(np.uint8)
+        #the gap between the strips' inner top corners spans the angle TargetAnalyzer expects at this distance
+        gap_degrees = 2.0 * math.degrees(math.atan((TARGET_GAP_INCHES / 2.0) / distance))
+        pixels_per_inch = (gap_degrees * self.width / CAMERA_FOV_WIDTH_DEGREES) / TARGET_GAP_INCHES
+        center_x = self.width / 2.0 + heading * self.width / CAMERA_FOV_WIDTH_DEGREES
+        vertical_degrees = math.degrees(math.atan((CAMERA_HEIGHT_INCHES - TARGET_HEIGHT_STANDARD_INCHES) / distance))
+        top_y = self.height / 2.0 + vertical_degrees * self.height / CAMERA_FOV_HEIGHT_DEGREES
+        for outline in (self.left_strip, self.right_strip):
+            points = outline * pixels_per_inch + (center_x, top_y)
+            cv2.fillPoly(image, [np.int32(np.round(points * 16))], STRIP_COLOR, shift=4)  #shift=4 keeps 1/16 pixel precision
+        for _ in range(self.noise_blobs):
+            center = (int(self.random.randint(0, self.width)), int(self.random.randint(0, self.height)))
+            cv2.circle(image, center, int(self.random.randint(2, 9)), STRIP_COLOR, -1)
+        return image
+
+    #corners of a strip in inches, tilted by angle, with the inner corner of its top edge at x and its
+    #highest corner at y 0.  The target gap is measured between the inner top corners of the two strips.
+    def _strip_outline(self, angle, x):
+        corners = cv2.boxPoints(((0.0, 0.0), (STRIP_WIDTH_INCHES, STRIP_LENGTH_INCHES), angle)).astype(np.float64)
+        top_edge = corners[np.argsort(corners[:, 1])[:2]]
+        inner = top_edge[np.argmax(top_edge[:, 0])] if x < 0 else top_edge[np.argmin(top_edge[:, 0])]
+        return corners - (inner[0], corners[:, 1].min()) + (x, 0.0)
+
+    def _as_list(self, values):
+        return values if isinstance(values, (list, tuple)) else [values]
@@ -0,0 +1,62 @@
+import os
+import json
+import queue
+import threading
+
+MAX_BATCH = 256
+
+
+class TraceWriter:
+    """Writes timed spans to a Chrome trace-event file (chrome://tracing, ui.perfetto.dev)
+
+    span() only queues the span, so it never blocks the caller on the file.  The queue
+    is bounded and spans that arrive while it is full are dropped and counted.  The
+    file is a JSON array that is left open, which the trace viewers accept, so a
+    trace cut short by a crash or a power cut can still be loaded.
+    """
+    def __init__(self, filename, max_queued=10000):
+        self.filename = filename
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.written = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._writer_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #start and seconds are time.perf_counter() values, frame is the CameraFrame sequence (or None)
+    def span(self, name, category, start, seconds, frame=None):
+        thread = threading.current_thread()
+        try:
+            self.queue.put_nowait((name, category, start, seconds, frame, thread.ident, thread.name))
+        except queue.Full:
+            self.dropped += 1
+
+    def snapshot(self):
+        return {"file": self.filename, "queued": self.queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+    def _writer_thread(self):
+        pid = os.getpid()
+        thread_names = set()
+        with open(self.filename, "w") as trace_file:
+            trace_file.write("[\n")
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < MAX_BATCH:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                lines = []
+                for name, category, start, seconds, frame, tid, thread_name in batch:
+                    if tid not in thread_names:
+                        thread_names.add(tid)
+                        lines.append(json.dumps({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}}))
+                    event = {"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                             "ts": round(start * 1000000.0, 1), "dur": round(seconds * 1000000.0, 1)}
+                    if frame is not None:
+                        event["args"] = {"frame": frame}
+                    lines.append(json.dumps(event))
+                trace_file.write(",\n".join(lines) + ",\n")
+                self.written += len(batch)
+                if self.queue.empty():
+                    trace_file.flush()
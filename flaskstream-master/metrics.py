@@ -0,0 +1,150 @@
+import time
+import threading
+from collections import deque
+
+#upper edges (in milliseconds) of the latency histogram buckets - anything slower lands in the last bucket
+BUCKET_EDGES_MS = [1, 2, 5, 10, 20, 35, 50, 75, 100, 200, 500]
+
+
+class RollingHistogram:
+    """Latency samples for the most recent `window` events, in fixed memory"""
+    def __init__(self, window=300):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def snapshot(self):
+        samples = sorted(self.samples)
+        count = len(samples)
+        if count == 0:
+            return {"count": 0}
+        buckets = [0] * (len(BUCKET_EDGES_MS) + 1)
+        edge = 0
+        for sample in samples:  #samples are sorted, so the bucket index only moves forward
+            ms = sample * 1000.0
+            while edge < len(BUCKET_EDGES_MS) and ms > BUCKET_EDGES_MS[edge]:
+                edge += 1
+            buckets[edge] += 1
+        return {
+            "count": count,
+            "mean_ms": 1000.0 * sum(samples) / count,
+            "p50_ms": 1000.0 * samples[int(0.50 * (count - 1))],
+            "p95_ms": 1000.0 * samples[int(0.95 * (count - 1))],
+            "p99_ms": 1000.0 * samples[int(0.99 * (count - 1))],
+            "max_ms": 1000.0 * samples[-1],
+            "bucket_edges_ms": BUCKET_EDGES_MS,
+            "buckets": buckets,
+        }
+
+
+class RateCounter:
+    """Events per second over the most recent `window` events"""
+    def __init__(self, window=60):
+        self.times = deque(maxlen=window)
+        self.total = 0
+
+    def mark(self):
+        self.times.append(time.monotonic())
+        self.total += 1
+
+    def rate(self):
+        times = list(self.times)
+        if len(times) < 2:
+            return 0.0
+        elapsed = time.monotonic() - times[0]
+        return (len(times) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+class StageTimer:
+    """Context manager that records how long its block took into a CameraMetrics stage"""
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class FrameTimings:
+    """CameraMetrics for the stages of one frame
+
+    Records into the camera's histograms like CameraMetrics, and also sends every stage
+    to the trace as a span tagged with the frame's sequence number.
+    """
+    def __init__(self, metrics, frame):
+        self.metrics = metrics
+        self.sequence = None if frame is None else frame.sequence
+
+    def record(self, stage, seconds):
+        self.metrics.record(stage, seconds)
+        self.metrics.tracer.span(stage, self.metrics.role, time.perf_counter() - seconds, seconds, self.sequence)
+
+    def timer(self, stage):
+        return StageTimer(self, stage)
+
+
+class CameraMetrics:
+    """Per-camera stage latency histograms and frame rate counters
+
+    record(stage, seconds) matches StageTimings, so this can be handed straight to
+    ImageAnalyzer.run to collect per pipeline step timings.
+    """
+    def __init__(self, role):
+        self.role = role
+        self.tracer = None  #a TraceWriter when tracing is turned on
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.captured = RateCounter()
+        self.processed = RateCounter()
+        self.encoded = RateCounter()
+        self.dropped_frames = 0
+
+    def record(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, RollingHistogram())
+        histogram.record(seconds)
+
+    def timer(self, stage):
+        return StageTimer(self, stage)
+
+    #use in place of the metrics for stages that belong to one CameraFrame, so they show up in the trace
+    def for_frame(self, frame):
+        if self.tracer is None:
+            return self
+        return FrameTimings(self, frame)
+
+    def mark_captured(self):
+        self.captured.mark()
+
+    def mark_processed(self):
+        self.processed.mark()
+
+    def mark_encoded(self):
+        self.encoded.mark()
+
+    def mark_dropped(self, count=1):
+        self.dropped_frames += count
+
+    def snapshot(self):
+        with self.lock:
+            histograms = dict(self.histograms)
+        return {
+            "role": self.role,
+            "capture_fps": self.captured.rate(),
+            "processed_fps": self.processed.rate(),
+            "encoded_fps": self.encoded.rate(),
+            "frames_captured": self.captured.total,
+            "frames_processed": self.processed.total,
+            "frames_encoded": self.encoded.total,
+            "dropped_frames": self.dropped_frames,
+            "stages": {stage: histogram.snapshot() for stage, histogram in histograms.items()},
+        }
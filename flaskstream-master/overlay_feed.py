@@ -0,0 +1,53 @@
+import json
+import time
+
+KEEPALIVE = ": keepalive\n\n"  #an SSE comment - lets the server notice a viewer that went away
+
+
+def overlay_event(data):
+    return "data: {}\n\n".format(json.dumps(data))
+
+
+#Server-sent events with the target overlay of every analyzed frame from the live camera, for the
+#viewer to draw over /stream.  Follows the live camera like the stream does - an event with no overlay
+#is sent on each switch, and a camera without vision only gets keepalives.  Close the generator when
+#the viewer goes away.  With a bandwidth budget, events are held to the stream's frame rate - there's
+#no point drawing overlays faster than the frames under them.
+def overlay_events(robot):
+    camera = None
+    subscription = None
+    last_sent = 0.0
+    try:
+        while True:
+            if robot.live_camera is not camera:
+                if subscription is not None:
+                    subscription.close()
+                camera = robot.live_camera
+                subscription = camera.subscribe_overlay()
+                yield overlay_event({"camera": camera.role, "overlay": None})
+            if subscription is None:
+                time.sleep(1.0)
+                yield KEEPALIVE
+                continue
+            frame = subscription.next_frame(timeout=1.0)
+            if frame is None:
+                yield KEEPALIVE
+                continue
+            if not _due(camera.stream_controller, last_sent):
+                continue
+            last_sent = time.monotonic()
+            yield overlay_event({
+                "camera": camera.role,
+                "sequence": frame.sequence,
+                "flipped": robot.flip_image,  #the stream image is mirrored, so the overlay must be too
+                "overlay": None if frame.overlay is None else frame.overlay.as_dict(),
+            })
+    finally:
+        if subscription is not None:
+            subscription.close()
+
+
+def _due(controller, last_sent):
+    if controller is None or not controller.is_adaptive():
+        return True
+    return time.monotonic() - last_sent >= 1.0 / controller.fps
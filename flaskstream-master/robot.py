@@ -1,12 +1,20 @@
 import time
 import os
 import sys
-import subprocess
 import threading
 import yaml
 from udp import UdpCommandListener
 from udp import UdpSender
 from camera import RobotCamera
+import v4l2
+from datetime import datetime
+from snapshot_writer import SnapshotWriter
+from frame_trace import TraceWriter
+from stats_protocol import encode_stats
+from vision.vision_settings import VisionSettings, DEFAULT_SETTINGS
+from vision.camera_calibration import CameraCalibration
+
+CONFIG_WATCH_INTERVAL_SECONDS = 1.0
 
 class Robot:
 
@@ -24,6 +32,19 @@ class Robot:
         self.take_snapshot_now = True #take a snap on startup
         self.target_path_bearing = None
         self.flip_image = False
+        self.draw_overlay = True  #burn the vision overlay into the stream - off when viewers draw it from /overlay
+        self.vision_workers = 0  #0 runs vision on the camera's own thread
+        self.stream_bandwidth = {}
+        self.stats_format = "text"  #"binary" sends stats_protocol packets, "text" is the original message format
+        self.stats_sequence = 0
+        self.vision_settings = DEFAULT_SETTINGS  #swapped as a whole on reload - see VisionSettings
+        self.config_watch_thread = None
+        self.config_mtime = None
+        self.snapshot_writer = None
+        self.flight_recorder_seconds = 0  #0 turns the flight recorder off
+        self.trace_file = None  #set to write a Chrome trace of every frame's stages
+        self.trace_writer = None
+        self.startup_status = {}  #each configured camera's startup_status by role - kept for cameras that failed, see /status
 
     def startup(self):
         self._setup()
@@ -32,6 +53,7 @@ class Robot:
         else:
             self.live_camera = self.front_camera
         self.init_udp_thread()
+        self.init_config_watch_thread()
 
     def init_udp_thread(self):
         if self.udp_listener_thread is None:
@@ -44,6 +66,53 @@ class Robot:
         print("listening to udp")
         udp.start()
 
+    def init_config_watch_thread(self):
+        if self.config_watch_thread is None:
+            self.config_watch_thread = threading.Thread(target=self.watch_config)
+            self.config_watch_thread.start()
+
+    #reloads the vision settings whenever config.yml is saved
+    def watch_config(self):
+        while True:
+            time.sleep(CONFIG_WATCH_INTERVAL_SECONDS)
+            try:
+                mtime = os.stat(self._config_path()).st_mtime
+            except OSError:
+                continue
+            if mtime != self.config_mtime:
+                self.config_mtime = mtime
+                print("config.yml changed - reloading vision settings")
+                self.reload_vision_settings()
+
+    #compiles the vision section of config.yml and swaps it in between frames.  On any error the
+    #current settings are kept.
+    def reload_vision_settings(self):
+        try:
+            self.vision_settings = VisionSettings.from_config(self._load_config().get("vision"))
+            return True
+        except Exception as error:
+            print(error)
+            print("unable to reload vision settings - keeping the current ones")
+            return False
+
+    #VISION <setting> <value> - e.g. "VISION MIN_AREA 100", "VISION CANDIDATES COMPONENTS" or "VISION PIPELINE GAUSSIAN_BLUR; ERODE 2"
+    def update_vision_setting(self, args):
+        if len(args) < 2:
+            return "ERROR"
+        key = args[0].lower()
+        try:
+            if key == "pipeline":
+                value = "\n".join(step.strip() for step in " ".join(args[1:]).split(";"))
+            elif key == "candidates":
+                value = args[1].lower()  #commands arrive upper-cased
+            else:
+                value = float(args[1])
+            self.vision_settings = self.vision_settings.with_value(key, value)
+        except Exception as error:
+            print(error)
+            return "ERROR"
+        return "OK"
+
     def send_udp_message_to_robot(self, message):
         self.udp_sender.send(message.encode("utf-8"))
 
@@ -66,22 +135,73 @@ class Robot:
                 self.flip_image = False
             else:
                 self.flip_image = True
+        elif cmd == "RELOAD":
+            self.reload_vision_settings()
+        elif cmd == "VISION":
+            return self.update_vision_setting(cmds)
+        elif cmd == "DUMP":
+            return self.dump_flight_recorder()
         return "OK"
 
-    def send_stats_to_robot(self, stats, camera):
-        msg = self._format_stats_message(stats, camera)
-        self.send_udp_message_to_robot(msg)
+    def send_stats_to_robot(self, stats, camera, frame=None):
+        with camera.metrics.for_frame(frame).timer("send_stats"):
+            if self.stats_format == "binary":
+                self.udp_sender.send(self._encode_stats_packet(stats, camera, frame))
+            else:
+                msg = self._format_stats_message(stats, camera, frame)
+                self.send_udp_message_to_robot(msg)
+
+    #writes each camera's flight recorder to ../snapshots/flight-<time>-<role> in the background
+    def dump_flight_recorder(self):
+        result = "OK"
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        for camera in [self.front_camera, self.rear_camera]:
+            if camera is not None and camera.recorder is not None:
+                if not camera.recorder.dump("../snapshots/flight-{}-{}".format(stamp, camera.role)):
+                    print("{} flight recorder is already dumping".format(camera.role))
+                    result = "BUSY"
+        return result
+
+    def metrics(self):
+        cameras = {}
+        for camera in [self.front_camera, self.rear_camera]:
+            if camera is not None:
+                cameras[camera.role] = camera.metrics.snapshot()
+                cameras[camera.role]["tracking"] = {"roi_frames": camera.tracker.roi_frames, "full_frames": camera.tracker.full_frames}
+                if camera.stream_controller is not None:
+                    cameras[camera.role]["stream"] = camera.stream_controller.snapshot()
+                if camera.recorder is not None:
+                    cameras[camera.role]["flight_recorder"] = camera.recorder.snapshot()
+                if camera.frame_buffers is not None:
+                    cameras[camera.role]["frame_buffers"] = camera.frame_buffers.snapshot()
+        return {
+            "live_camera": None if self.live_camera is None else self.live_camera.role,
+            "cameras": cameras,
+            "snapshots": None if self.snapshot_writer is None else self.snapshot_writer.snapshot(),
+            "trace": None if self.trace_writer is None else self.trace_writer.snapshot(),
+        }
 
     #private methods
-    def _format_stats_message(self, stats, camera):
+    def _format_stats_message(self, stats, camera, frame=None):
         if stats[0] == False:
             stats_string = "0"
         else:
             stats_string = "1 {} {} {} {} {} {}".format(stats[1], stats[2], stats[3], stats[4], stats[5], stats[6])
-        return "{} {} {}".format(camera.role, stats_string, time.clock())
+        timestamp = time.monotonic() if frame is None else frame.capture_time
+        return "{} {} {}".format(camera.role, stats_string, timestamp)
+
+    def _encode_stats_packet(self, stats, camera, frame=None):
+        now = time.monotonic()
+        if frame is None:
+            self.stats_sequence += 1
+            sequence, capture_time = self.stats_sequence, now
+        else:
+            sequence, capture_time = frame.sequence, frame.capture_time
+        return encode_stats(stats, camera.role, sequence, capture_time, 1000.0 * (now - capture_time))
 
     def _setup(self):
-        camera_defs, view_def = self._load_cameras_from_yaml()
+        config = self._load_config()
+        camera_defs, view_def = config['cameras'], config['camera_view']
         camera_devices = self._load_camera_devices()
         print(camera_devices)
         print(view_def)
@@ -90,7 +210,15 @@ class Robot:
         self.udp_inbound_command_port = view_def["udp_inbound_command_port"]
         self.udp_outbound_host = view_def["udp_outbound_host"]
         self.udp_outbound_port = view_def["udp_outbound_port"]
+        self.vision_workers = view_def.get("vision_workers", 0)
+        self.stream_bandwidth = config.get("stream_bandwidth") or {}
+        self.stats_format = view_def.get("stats_format", "text")
+        self.flight_recorder_seconds = view_def.get("flight_recorder_seconds", 0)
+        self.trace_file = view_def.get("trace_file")
+        self.draw_overlay = view_def.get("draw_overlay", True)
         self.udp_sender = UdpSender(self.udp_outbound_host, self.udp_outbound_port)
+        self.vision_settings = VisionSettings.from_config(config.get("vision"))
+        self.config_mtime = os.stat(self._config_path()).st_mtime
 
         self.front_camera = self._find_camera("front", camera_defs, camera_devices, view_def)
         self.rear_camera = self._find_camera("rear", camera_defs, camera_devices, view_def)
@@ -103,45 +231,85 @@ class Robot:
             if key_count > 1:
                 self.rear_camera = self._find_camera_by_serial(keys[1], "rear", camera_defs, camera_devices, view_def)
 
-    def _load_cameras_from_yaml(self):
-        with open(os.path.join(sys.path[0], "config.yml"), 'r') as ymlfile:
-            cfg = yaml.load(ymlfile)
-            print(cfg['cameras'])
-            return cfg['cameras'], cfg['camera_view']
+        self._start_cameras()
+
+    #brings every camera up at once rather than one after another, then drops any that failed to start
+    def _start_cameras(self):
+        cameras = [camera for camera in [self.front_camera, self.rear_camera] if camera is not None]
+        for camera in cameras:
+            #vision workers are forked, so they have to exist before any camera thread starts
+            camera.start_vision_pool()
+        self.snapshot_writer = SnapshotWriter()  #starts a thread, so after the fork too
+        if self.trace_file:
+            self.trace_writer = TraceWriter(self.trace_file)
+            for camera in cameras:
+                camera.metrics.tracer = self.trace_writer
+        threads = [threading.Thread(target=camera.start_streaming) for camera in cameras]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for camera in cameras:
+            print("{} camera startup: {}".format(camera.role, camera.startup_status))
+            self.startup_status[camera.role] = camera.startup_status
+        if self.front_camera is not None and not self.front_camera.is_ready():
+            self.front_camera = None
+        if self.rear_camera is not None and not self.rear_camera.is_ready():
+            self.rear_camera = None
+
+    #every camera that was started, including any dropped because they failed
+    def camera_status(self):
+        return self.startup_status
+
+    #how the viewer should show the live stream - passthrough frames arrive unflipped, so the page mirrors them,
+    #and client_overlay tells the page to draw the vision overlay from /overlay itself, since the stream has none
+    def view_settings(self):
+        camera = self.live_camera
+        return {
+            "camera": None if camera is None else camera.role,
+            "mirror": camera is not None and camera.passthrough and self.flip_image,
+            "client_overlay": not self.draw_overlay,
+        }
+
+    def _config_path(self):
+        return os.path.join(sys.path[0], "config.yml")
+
+    def _load_config(self):
+        with open(self._config_path(), 'r') as ymlfile:
+            return yaml.safe_load(ymlfile)
 
     def _find_camera(self, key, camera_defs, devices, view):
-        serial_number = str(camera_defs[key]["serial"])
-        return self._find_camera_by_serial(serial_number, key, camera_defs, devices, view)
+        camera_def = camera_defs.get(key) or {}
+        source = camera_def.get("source")
+        if source is not None and source.get("type", "v4l2") != "v4l2":
+            camera = self._create_camera(source["type"], 0, key, None, source, view)
+        else:
+            serial_number = str(camera_def.get("serial"))
+            camera = self._find_camera_by_serial(serial_number, key, camera_defs, devices, view)
+        if camera is not None and camera_def.get("calibration") is not None:
+            camera.calibration = CameraCalibration(camera_def["calibration"])
+        if camera is not None and camera_def.get("passthrough", False):
+            camera.use_passthrough(self.stream_bandwidth.get("scale", [0.25, 0.5])[1])
+        return camera
 
     def _find_camera_by_serial(self, serial_number, role, camera_defs, devices, view):
         device = devices.get(serial_number, None)
         if device == None:
             return None
         else:
-            ndx = device["device_name"][-1]
-            camera = RobotCamera(self, device["device_name"], ndx, role, serial_number)
-            camera.width = view["width"]
-            camera.height = view["height"]
-            camera.fps = view["fps"]
-            camera.start_streaming()
-            return camera
+            ndx = device["device_name"][len("/dev/video"):]
+            return self._create_camera(device["device_name"], ndx, role, serial_number, None, view)
+
+    def _create_camera(self, device_name, ndx, role, serial_number, source, view):
+        camera = RobotCamera(self, device_name, ndx, role, serial_number)
+        camera.source = source
+        camera.width = view["width"]
+        camera.height = view["height"]
+        camera.fps = view["fps"]
+        return camera
 
     def _load_camera_devices(self):
         devices = {}
-        for i in range(0,6):
-            device_name = "/dev/video{}".format(str(i))
-            serial_number = self._value_from_udev(device_name, "ID_SERIAL_SHORT")
-            if len(serial_number) > 2:
-                devices[serial_number] = {"device_name": device_name, "serial_number": serial_number}
+        for serial_number, device_name in v4l2.find_devices_by_serial().items():
+            devices[serial_number] = {"device_name": device_name, "serial_number": serial_number}
         return devices
-
-    def _value_from_udev(self, device_name, key):
-        cmd = "udevadm info --query=property {} | grep {}".format(device_name, key)
-        value = ""
-        try:
-            value = subprocess.check_output(cmd, shell = True)
-            value = value.decode().strip().split("=")[1]
-        except:
-            return ""
-        return value
-
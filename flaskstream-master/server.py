@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, Response, jsonify
 from robot import Robot
+from overlay_feed import overlay_events
 import time
 
 app = Flask(__name__)
@@ -19,13 +20,49 @@ def stream():
     return Response(generate_stream(),
                     mimetype='multipart/x-mixed-replace; boundary=--frame')
 
+#the vision overlay for each frame, for the page to draw over /stream - see overlay_feed
+@app.route('/overlay')
+def overlay():
+    return Response(overlay_events(robot), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/metrics')
+def metrics():
+    return jsonify(robot.metrics())
+
+@app.route('/status')
+def status():
+    return jsonify(robot.camera_status())
+
+@app.route('/view')
+def view():
+    return jsonify(robot.view_settings())
+
 def generate_stream():
-    while True:
-        time.sleep(robot.frame_lag)
-        frame = robot.live_camera.get_frame()
-        size = len(frame)
-        prefix = "--frame\r\nContent-Type: image/jpeg\r\nContent-length: {}\r\n\r\n".format(size).encode('utf-8')
-        yield prefix + frame + b'\r\n'
+    camera = None
+    subscription = None
+    try:
+        while True:
+            time.sleep(robot.frame_lag)
+            if robot.live_camera is not camera:
+                #the live camera was switched - follow it
+                if subscription is not None:
+                    subscription.close()
+                camera = robot.live_camera
+                subscription = camera.subscribe()
+            frame = subscription.next_frame(timeout=1.0)
+            if frame is None:
+                continue
+            size = len(frame.jpeg)
+            prefix = "--frame\r\nContent-Type: image/jpeg\r\nContent-length: {}\r\n\r\n".format(size).encode('utf-8')
+            started = time.perf_counter()
+            yield prefix + frame.jpeg + b'\r\n'
+            #the generator resumes once the frame is handed to the socket, which says nothing about the link,
+            #so flask viewers don't report a send rate - the stream adapts to the budget alone here
+            camera.metrics.for_frame(frame).record("client_write", time.perf_counter() - started)
+    finally:
+        #runs when the viewer disconnects and flask closes the generator
+        if subscription is not None:
+            subscription.close()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', threaded=True)
@@ -0,0 +1,48 @@
+import os
+import queue
+import threading
+import cv2
+
+
+class SnapshotWriter:
+    """Encodes and writes snapshots on a background thread
+
+    write() only queues the image, so the camera threads never wait on the SD card.
+    The queue is bounded - when it is full the snapshot is dropped and counted rather
+    than letting images pile up in memory.  Queued images must not be modified afterwards.
+    """
+    def __init__(self, max_queued=8, jpeg_quality=90):
+        self.jpeg_quality = jpeg_quality
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.written = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._writer_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #returns False if the queue was full and the snapshot was dropped
+    def write(self, filename, image):
+        try:
+            self.queue.put_nowait((filename, image))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def snapshot(self):
+        return {"queued": self.queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+    def _writer_thread(self):
+        while True:
+            filename, image = self.queue.get()
+            try:
+                directory = os.path.dirname(filename)
+                if directory != "" and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                if cv2.imwrite(filename, image, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality]):
+                    self.written += 1
+                else:
+                    print("unable to write snapshot {}".format(filename))
+            except Exception as error:
+                print(error)
+                print("unable to write snapshot {}".format(filename))
@@ -0,0 +1,58 @@
+import math
+import struct
+
+#Binary vision stats packet, sent to the roboRIO once per analyzed frame.  All fields are
+#big-endian (network order) so they can be read with a plain java.nio.ByteBuffer:
+#
+#  offset  type     field
+#  0       uint16   magic (0x5653, "VS")
+#  2       uint8    version
+#  3       uint8    camera role (see ROLE_CODES)
+#  4       uint8    flags (bit 0 = target pair found)
+#  5       3 bytes  padding
+#  8       uint32   frame sequence number
+#  12      float64  capture timestamp (seconds, co-processor monotonic clock)
+#  20      float32  milliseconds from capture to send
+#  24      float32  target center x (pixels)
+#  28      float32  target top y (pixels)
+#  32      float32  heading (degrees)
+#  36      float32  distance from target gap (inches)
+#  40      float32  distance from vertical, rocket cargo (inches)
+#  44      float32  distance from vertical (inches)
+#
+#The float fields after the latency are NaN when no target pair was found.
+STATS_MAGIC = 0x5653
+STATS_VERSION = 1
+STATS_PACKET = struct.Struct("!HBBB3xIdf6f")
+FLAG_SUCCESS = 0x01
+ROLE_CODES = {"front": 1, "rear": 2}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+STAT_FIELDS = ["center_x", "top_y", "heading", "distance_target_gap", "distance_vertical_rocket_cargo", "distance_vertical"]
+
+
+def encode_stats(stats, role, sequence, capture_time, latency_ms):
+    success = stats[0] == True
+    values = [float(v) if v is not None else math.nan for v in stats[1:7]] if success else []
+    values += [math.nan] * (len(STAT_FIELDS) - len(values))
+    return STATS_PACKET.pack(STATS_MAGIC, STATS_VERSION, ROLE_CODES.get(role, 0), FLAG_SUCCESS if success else 0,
+                             sequence & 0xFFFFFFFF, capture_time, latency_ms, *values)
+
+
+#returns a dict of the packet's fields, or None if data isn't a stats packet this version understands
+def decode_stats(data):
+    if len(data) != STATS_PACKET.size:
+        return None
+    fields = STATS_PACKET.unpack(data)
+    magic, version, role, flags, sequence, capture_time, latency_ms = fields[:7]
+    if magic != STATS_MAGIC or version != STATS_VERSION:
+        return None
+    decoded = {
+        "role": ROLE_NAMES.get(role, "unknown"),
+        "success": bool(flags & FLAG_SUCCESS),
+        "sequence": sequence,
+        "capture_time": capture_time,
+        "latency_ms": latency_ms,
+    }
+    for name, value in zip(STAT_FIELDS, fields[7:]):
+        decoded[name] = value
+    return decoded
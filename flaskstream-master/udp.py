@@ -4,10 +4,15 @@ class UdpSender:
     def __init__(self, ip_address, ip_port):
         self.host = ip_address
         self.port = ip_port
+        #one socket for the life of the sender rather than one per datagram
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.address = (self.host, self.port)
 
     def send(self, message):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(message, (self.host, self.port))
+        self.sock.sendto(message, self.address)
+
+    def close(self):
+        self.sock.close()
 
 class UdpCommandListener:
     def __init__(self, host, port, command_processor):
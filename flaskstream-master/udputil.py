@@ -1,21 +1,38 @@
 #!/usr/bin/env python3
 
 import sys, getopt
+import socket
 from udp import UdpSender
+from stats_protocol import decode_stats
+
+USAGE = "udputil.py -s <server_hostname_or_ip> -p <server_port> -m <message_to_send>\n       udputil.py -l -p <port_to_listen_on>   (prints vision stats packets)"
+
+def listen(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", port))
+    while True:
+        data, addr = sock.recvfrom(1024)
+        stats = decode_stats(data)
+        if stats is None:
+            print("{} text: {}".format(addr[0], data.decode("utf-8", "replace")))
+        else:
+            print("{} binary: {}".format(addr[0], stats))
 
 def main(argv):
     server = "10.45.13.12"
     port = 5800
     msg = "ping"
+    listening = False
 
     try:
-        opts, args = getopt.getopt(argv, "hs:p:m:")
+        opts, args = getopt.getopt(argv, "hs:p:m:l")
     except getopt.GetoptError:
-        print ("udputil.py -s <server_hostname_or_ip> -p <server_port> -m <message_to_send>")
+        print (USAGE)
         sys.exit(2)
     for opt, arg in opts:
         if opt == "-h":
-            print ("udputil.py -s <server_hostname_or_ip> -p <server_port> -m <message_to_send>")
+            print (USAGE)
             sys.exit(2)
         elif opt == "-s":
             server = arg
@@ -23,10 +40,16 @@ def main(argv):
             port = int(arg)
         elif opt == "-m":
             msg = arg
+        elif opt == "-l":
+            listening = True
         else:
-            print ("udputil.py -s <server_hostname_or_ip> -p <server_port> -m <message_to_send>")
+            print (USAGE)
             sys.exit(2)
 
+    if listening:
+        listen(port)
+        return
+
     udp = UdpSender(server, port)
     udp.send(msg.encode("utf-8")) 
 
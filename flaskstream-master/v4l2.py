@@ -0,0 +1,86 @@
+import os
+import glob
+import fcntl
+import struct
+
+#Talks to video4linux devices directly through sysfs and ioctls, instead of shelling out
+#to udevadm and v4l2-ctl for every value.
+
+SYSFS_VIDEO_DEVICES = "/sys/class/video4linux"
+
+#from linux/videodev2.h
+VIDIOC_S_CTRL = 0xC008561C      # _IOWR('V', 28, struct v4l2_control)
+VIDIOC_S_PARM = 0xC0CC5616      # _IOWR('V', 22, struct v4l2_streamparm)
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+STREAMPARM_SIZE = 204
+CONTROL_IDS = {
+    "brightness": 0x00980900,
+    "contrast": 0x00980901,
+    "saturation": 0x00980902,
+    "white_balance_temperature_auto": 0x0098090c,
+    "gain": 0x00980913,
+    "white_balance_temperature": 0x0098091a,
+    "exposure_auto": 0x009a0901,
+    "exposure_absolute": 0x009a0902,
+}
+
+
+def _read_sysfs(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+#returns {serial_number: device_name} for every video capture node that belongs to a USB device with a serial number
+def find_devices_by_serial():
+    devices = {}
+    for node in sorted(glob.glob(os.path.join(SYSFS_VIDEO_DEVICES, "video*"))):
+        #newer kernels add a metadata node (index 1) for every camera - only the first node captures video
+        index = _read_sysfs(os.path.join(node, "index"))
+        if index is not None and index != "0":
+            continue
+        serial_number = usb_serial(node)
+        if serial_number is not None and len(serial_number) > 2:
+            devices[serial_number] = "/dev/" + os.path.basename(node)
+    return devices
+
+
+#the video node's "device" link points at the USB interface - the serial lives on the USB device above it,
+#the first directory up with an idVendor.  Nothing further up is read, so a camera without a serial
+#doesn't pick up its hub's.
+def usb_serial(node):
+    path = os.path.realpath(os.path.join(node, "device"))
+    for _ in range(3):
+        if os.path.exists(os.path.join(path, "idVendor")):
+            return _read_sysfs(os.path.join(path, "serial"))
+        path = os.path.dirname(path)
+    return None
+
+
+#sets each named control (see CONTROL_IDS) - returns the names of any that the device rejected
+def set_controls(device_name, controls):
+    failed = []
+    fd = os.open(device_name, os.O_RDWR)
+    try:
+        for name, value in controls.items():
+            try:
+                fcntl.ioctl(fd, VIDIOC_S_CTRL, struct.pack("Ii", CONTROL_IDS[name], int(value)))
+            except (OSError, KeyError):
+                failed.append(name)
+    finally:
+        os.close(fd)
+    return failed
+
+
+def set_frame_rate(device_name, fps):
+    #struct v4l2_streamparm: u32 type, then v4l2_captureparm - capability, capturemode, timeperframe {numerator, denominator}, ...
+    parm = bytearray(STREAMPARM_SIZE)
+    struct.pack_into("I", parm, 0, V4L2_BUF_TYPE_VIDEO_CAPTURE)
+    struct.pack_into("II", parm, 12, 1, int(fps))
+    fd = os.open(device_name, os.O_RDWR)
+    try:
+        fcntl.ioctl(fd, VIDIOC_S_PARM, parm)
+    finally:
+        os.close(fd)
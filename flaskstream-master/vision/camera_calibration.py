@@ -0,0 +1,83 @@
+import numpy as np
+import cv2
+
+CAMERA_FOV_WIDTH_DEGREES = 61.179  # CODED FOR LOGITECH C920 HORIZONTAL FOV (empirical)
+CAMERA_FOV_HEIGHT_DEGREES = 43.3   # CODED FOR LOGITECH C922 VERTICAL FOV (specs)
+
+
+class CameraCalibration:
+    """Lens calibration for one camera, from the calibration entry in config.yml
+
+    Without a calibration the original linear field of view model is used.  With one,
+    camera_matrix and dist_coeffs are the cv2.calibrateCamera results at the width and
+    height given, and are rescaled to whatever resolution the camera runs at.  The angle
+    tables are built once per resolution - see at_size.
+    """
+    def __init__(self, config=None):
+        self.config = config
+        self.tables = {}
+
+    def at_size(self, width, height):
+        tables = self.tables.get((width, height))
+        if tables is None:
+            tables = AngleTables(width, height, *self._scaled(width, height))
+            self.tables[(width, height)] = tables
+        return tables
+
+    def _scaled(self, width, height):
+        if self.config is None:
+            return None, None
+        camera_matrix = np.array(self.config["camera_matrix"], dtype=np.float64).reshape(3, 3)
+        scale_x = float(width) / self.config.get("width", width)
+        scale_y = float(height) / self.config.get("height", height)
+        camera_matrix[0] *= scale_x
+        camera_matrix[1] *= scale_y
+        return camera_matrix, np.array(self.config.get("dist_coeffs", []), dtype=np.float64)
+
+
+class AngleTables:
+    """Angle off the camera axis for every pixel column and row at one resolution
+
+    Heading and elevation are lookups (interpolated between pixels) instead of per frame
+    trig.  With a camera matrix, the handful of points a measurement uses are undistorted
+    first and the tables hold the pinhole angle of each undistorted column and row.
+    Without one, undistort is a no-op and the tables hold exactly the linear model's
+    values, so results match the uncalibrated math.
+    """
+    def __init__(self, width, height, camera_matrix=None, dist_coeffs=None):
+        self.width = width
+        self.height = height
+        self.camera_matrix = camera_matrix
+        self.dist_coeffs = dist_coeffs
+        #undistorted points can land outside the frame, so the tables reach half a frame past each edge
+        self.columns = np.arange(-(width // 2), width + width // 2 + 1, dtype=np.float64)
+        self.rows = np.arange(-(height // 2), height + height // 2 + 1, dtype=np.float64)
+        if camera_matrix is None:
+            center_x = width / 2
+            center_y = height / 2
+            column_angles = CAMERA_FOV_WIDTH_DEGREES * np.abs(center_x - self.columns) / width
+            self.column_angles = np.where(self.columns < center_x, -column_angles, column_angles)
+            self.row_angles = ((center_y - self.rows) * CAMERA_FOV_HEIGHT_DEGREES) / height
+        else:
+            fx, fy = camera_matrix[0, 0], camera_matrix[1, 1]
+            cx, cy = camera_matrix[0, 2], camera_matrix[1, 2]
+            self.column_angles = np.degrees(np.arctan((self.columns - cx) / fx))
+            self.row_angles = np.degrees(np.arctan((cy - self.rows) / fy))
+
+    #points is a list of (x, y) pixel positions - returns them as an n x 2 array with lens distortion removed
+    def undistort(self, points):
+        points = np.array(points, dtype=np.float64).reshape(-1, 2)
+        if self.camera_matrix is None:
+            return points
+        return cv2.undistortPoints(points.reshape(-1, 1, 2), self.camera_matrix, self.dist_coeffs, P=self.camera_matrix).reshape(-1, 2)
+
+    #degrees right of the camera axis (negative is left) for an undistorted x
+    def heading_degrees(self, x):
+        return float(np.interp(x, self.columns, self.column_angles))
+
+    #degrees above the camera axis (negative is below) for an undistorted y
+    def elevation_degrees(self, y):
+        return float(np.interp(y, self.rows, self.row_angles))
+
+
+LINEAR_CALIBRATION = CameraCalibration()
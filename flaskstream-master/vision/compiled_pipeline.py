@@ -0,0 +1,139 @@
+import functools
+
+import numpy as np
+import cv2
+
+#Default kernel used by cv2.erode/cv2.dilate when no kernel is given
+MORPH_KERNEL = np.ones((3, 3), np.uint8)
+
+
+class PipelineStep:
+    """A single pipeline operation with its arguments already parsed and bound"""
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+
+    #dst is optional - an array for the result to be written into, see PipelineBuffers
+    def __call__(self, img, dst=None):
+        return self.fn(img, dst)
+
+    def __repr__(self):
+        return "PipelineStep({})".format(self.name)
+
+
+class CompiledPipeline:
+    """ANALYSIS_PIPELINE text compiled once into a list of pre-bound steps
+
+    Each line of the pipeline text is parsed into a PipelineStep when the pipeline is
+    compiled, so running a frame is just a walk over the step list.  Adjacent steps
+    are fused where the result is identical (e.g. rgb_filter becomes a single inRange
+    on the BGR image, and erode N followed by dilate N becomes a morphological open).
+
+    morphology_scale scales the erode and dilate iteration counts, for running the
+    pipeline on an image downsampled that much - a step scaled down to 0 is left out.
+    """
+    #only the last few pipelines are kept - tuning the pipeline over UDP compiles a new one each time
+    @classmethod
+    @functools.lru_cache(maxsize=8)
+    def for_config(cls, pipeline_text, morphology_scale=1.0):
+        return cls(pipeline_text, morphology_scale)
+
+    def __init__(self, pipeline_text, morphology_scale=1.0):
+        self.source = pipeline_text
+        self.morphology_scale = morphology_scale
+        self.steps = self._fuse(self._parse(pipeline_text))
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def _parse(self, pipeline_text):
+        ops = []
+        for line in pipeline_text.splitlines():
+            args = line.split()
+            if len(args) == 0:
+                continue
+            command = args.pop(0).upper()
+            if command not in OPERATIONS:
+                continue  #unknown commands were always a noop
+            args = [int(arg) for arg in args]
+            if command in ("ERODE", "DILATE") and self.morphology_scale != 1.0:
+                args[0] = int(args[0] * self.morphology_scale)
+                if args[0] == 0:
+                    continue
+            ops.append((command, args))
+        return ops
+
+    def _fuse(self, ops):
+        steps = []
+        i = 0
+        while i < len(ops):
+            command, args = ops[i]
+            if i + 1 < len(ops):
+                next_command, next_args = ops[i + 1]
+                #erode N + dilate N is exactly an open, dilate N + erode N is exactly a close
+                if command == "ERODE" and next_command == "DILATE" and args[0] == next_args[0]:
+                    steps.append(morphology_step("open", cv2.MORPH_OPEN, args[0]))
+                    i += 2
+                    continue
+                if command == "DILATE" and next_command == "ERODE" and args[0] == next_args[0]:
+                    steps.append(morphology_step("close", cv2.MORPH_CLOSE, args[0]))
+                    i += 2
+                    continue
+            steps.append(OPERATIONS[command](args))
+            i += 1
+        return steps
+
+
+def bounds_from_args(args, order=(0, 1, 2)):
+    #args are lower/upper pairs per channel: c1_lo c1_hi c2_lo c2_hi c3_lo c3_hi
+    lower = tuple(args[2 * channel] for channel in order)
+    upper = tuple(args[2 * channel + 1] for channel in order)
+    return lower, upper
+
+
+def color_filter_step(name, conversion, args):
+    lower, upper = bounds_from_args(args)
+    def apply(img, dst):
+        return cv2.inRange(cv2.cvtColor(img, conversion), lower, upper, dst=dst)
+    return PipelineStep(name, apply)
+
+
+def rgb_filter_step(args):
+    #swap the bounds into BGR order so the image never needs to be converted
+    lower, upper = bounds_from_args(args, order=(2, 1, 0))
+    return PipelineStep("rgb_filter", lambda img, dst: cv2.inRange(img, lower, upper, dst=dst))
+
+
+def morphology_step(name, operation, iterations):
+    return PipelineStep(name, lambda img, dst: cv2.morphologyEx(img, operation, MORPH_KERNEL, dst=dst, iterations=iterations))
+
+
+def binary_threshold_step(args):
+    min, max = args[0], args[1]
+    return PipelineStep("binary_threshold", lambda img, dst: cv2.threshold(img, min, max, cv2.THRESH_BINARY, dst=dst)[1])
+
+
+def erode_step(args):
+    iterations = args[0]
+    return PipelineStep("erode", lambda img, dst: cv2.erode(img, MORPH_KERNEL, dst=dst, iterations=iterations))
+
+
+def dilate_step(args):
+    iterations = args[0]
+    return PipelineStep("dilate", lambda img, dst: cv2.dilate(img, MORPH_KERNEL, dst=dst, iterations=iterations))
+
+
+OPERATIONS = {
+    "BGR2HSL": lambda args: PipelineStep("bgr2hsl", lambda img, dst: cv2.cvtColor(img, cv2.COLOR_BGR2HLS, dst=dst)),
+    "BGR2GRAY": lambda args: PipelineStep("bgr2gray", lambda img, dst: cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=dst)),
+    "GAUSSIAN_BLUR": lambda args: PipelineStep("gaussian_blur", lambda img, dst: cv2.GaussianBlur(img, (5, 5), 0, dst=dst)),
+    "BINARY_THRESHOLD": binary_threshold_step,
+    "ERODE": erode_step,
+    "DILATE": dilate_step,
+    "HSL_FILTER": lambda args: color_filter_step("hsl_filter", cv2.COLOR_BGR2HLS, args),
+    "HSV_FILTER": lambda args: color_filter_step("hsv_filter", cv2.COLOR_BGR2HSV, args),
+    "RGB_FILTER": rgb_filter_step,
+}
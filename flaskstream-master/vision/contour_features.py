@@ -0,0 +1,77 @@
+import numpy as np
+import cv2
+
+
+class ContourFeatureTable:
+    """Features for every candidate contour in a frame, computed once
+
+    Each row holds one contour's area, bounding box, centroid, rotated rectangle,
+    rotated rectangle corner points, angle from vertical and top point.  The
+    OpenCV calls are made once per contour and the angle math is done for the whole
+    table at once with numpy.  VisionTarget is a view over a single row.
+    """
+
+    @classmethod
+    def from_contours(cls, contours, min_area, max_area, min_aspect_ratio, max_aspect_ratio):
+        #this is more of a pre-filter - only the cheap features are computed for contours that get rejected
+        kept = []
+        areas = []
+        bboxes = []
+        for c in contours:
+            area = cv2.contourArea(c)
+            if area < min_area or area > max_area:
+                continue
+            bbox = cv2.boundingRect(c)
+            aspect_ratio = float(bbox[2]) / bbox[3]
+            if aspect_ratio > max_aspect_ratio or aspect_ratio < min_aspect_ratio:
+                continue
+            kept.append(c)
+            areas.append(area)
+            bboxes.append(bbox)
+        return ContourFeatureTable(kept, areas, bboxes)
+
+    def __init__(self, contours, areas=None, bboxes=None):
+        self.contours = contours
+        count = len(contours)
+        if areas is None:
+            areas = [cv2.contourArea(c) for c in contours]
+        if bboxes is None:
+            bboxes = [cv2.boundingRect(c) for c in contours]
+        self.area = np.array(areas, dtype=np.float64).reshape(count)
+        self.bbox = np.array(bboxes, dtype=np.int32).reshape(count, 4)
+        self.centroid = np.zeros((count, 2), dtype=np.int32)
+        self.top_point = np.zeros((count, 2), dtype=np.int32)
+        self.box_points = np.zeros((count, 4, 2), dtype=np.intp)
+        self.rotated_rectangles = []
+        for i, c in enumerate(contours):
+            m = cv2.moments(c)
+            if m["m00"] != 0:
+                self.centroid[i] = (int(m["m10"] / m["m00"]), int(m["m01"] / m["m00"]))
+            self.top_point[i] = c[c[:, 0, 1].argmin(), 0]
+            rotated_rectangle = cv2.minAreaRect(c)
+            self.rotated_rectangles.append(rotated_rectangle)
+            self.box_points[i] = np.intp(cv2.boxPoints(rotated_rectangle))
+        self.top_y = self.top_point[:, 1]
+        self.angle = self._angles_from_vertical(self.box_points)
+
+    def __len__(self):
+        return len(self.contours)
+
+    def _angles_from_vertical(self, points):
+        #same math as the old per-target angle_from_vertical, done for all rows at once:
+        #take the longer of the first two rectangle edges and measure its angle from vertical
+        p0 = points[:, 0, :].astype(np.float64)
+        p1 = points[:, 1, :].astype(np.float64)
+        p2 = points[:, 2, :].astype(np.float64)
+        d01 = np.sum((p1 - p0) ** 2, axis=1)
+        d12 = np.sum((p2 - p1) ** 2, axis=1)
+        use_second_edge = (d12 > d01)[:, None]
+        start = np.where(use_second_edge, p1, p0)
+        end = np.where(use_second_edge, p2, p1)
+        xdelta = np.abs(end[:, 0] - start[:, 0])
+        ydelta = np.abs(end[:, 1] - start[:, 1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            theta = 90.0 - np.degrees(np.arctan(ydelta / xdelta))
+        theta[xdelta == 0.0] = 0.0
+        #if slope is negative, then the angle is returned as negative
+        return np.where(start[:, 0] > end[:, 0], -theta, theta)
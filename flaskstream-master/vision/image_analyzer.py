@@ -1,37 +1,145 @@
+import time
+import math
 import cv2
 import numpy as np
 from vision.image_processing_pipeline import ImageProcessingPipeline
 from vision.target_analyzer import TargetAnalyzer
 from vision.vision_target import VisionTarget
+from vision.vision_settings import DEFAULT_SETTINGS
+from vision.camera_calibration import LINEAR_CALIBRATION
+from vision.target_overlay import TargetOverlay
+
+PYRAMID_PADDING = 6  #downsampled pixels added around a matched target before refining - covers thin tips the coarse pipeline erodes away
 
 class ImageAnalyzer:
     @classmethod
-    def run(cls, image, position):
-        analyzer = ImageAnalyzer(image, position)
+    def run(cls, image, position, timings=None, tracker=None, settings=None, calibration=None):
+        analyzer = ImageAnalyzer(image, position, timings, tracker, settings, calibration)
         return analyzer.execute()
 
-    def __init__(self, image, position):
+    #timings is optional - anything with a record(stage, seconds) method (see StageTimings)
+    #tracker is optional - a TargetTracker kept per camera turns on region-of-interest tracking
+    #settings is optional - a VisionSettings, otherwise the built in defaults are used
+    #calibration is optional - the camera's CameraCalibration, otherwise the linear field of view model is used
+    #buffers is optional - a PipelineBuffers to reuse, in which case the processed image is only valid until the next run with it
+    #with annotate False the image is left untouched (and not copied) - draw the overlay where it's needed instead
+    def __init__(self, image, position, timings=None, tracker=None, settings=None, calibration=None, buffers=None, annotate=True):
         self.image = image
-        self.original_image = np.copy(self.image)
+        self.timings = timings
+        self.tracker = tracker
+        self.settings = settings if settings is not None else DEFAULT_SETTINGS
+        self.calibration = calibration if calibration is not None else LINEAR_CALIBRATION
+        self.buffers = buffers
+        self.annotate = annotate
+        self.original_image = np.copy(self.image) if annotate else self.image
         self.position = position
         self.height, self.width = self.image.shape[:2]
-        self.center_x = int(self.width / 2)
+        self.overlay = None
 
+    #returns (original image, stats, processed image, annotated image) - the annotated image is None without annotate
     def execute(self):
-        #manipulates a copy of the image to find potential vision targets in the image
-        candidate_targets, img = ImageProcessingPipeline(self.image).run()
-
-        #analyzes candidate targets to find either a matching set of targets, or None
-        target_analyzer = TargetAnalyzer(candidate_targets, self.width, self.height)
-        target_analyzer.execute()
+        region = None if self.tracker is None else self.tracker.search_region()
+        target_analyzer, img = self.find_targets(region)
+        if region is not None and not target_analyzer.success:
+            #lost the pair inside the tracked region - search the whole frame before giving up
+            target_analyzer, img = self.find_targets(None)
+        if self.tracker is not None:
+            self.tracker.update(target_analyzer)
         target_analyzer.report()
         stats = target_analyzer.stats()
+        self.overlay = TargetOverlay(target_analyzer, self.width, self.height)
+        if not self.annotate:
+            return self.original_image, stats, img, None
 
         #Draw a centerline and any matching targets on the image
-        self.draw_centerline()
-        target_analyzer.draw_targets(self.image)
+        start = time.perf_counter()
+        self.overlay.draw(self.image)
+        self.record_timing("draw", start)
 
         return self.original_image, stats, img, self.image
 
-    def draw_centerline(self):
-        cv2.line(self.image, (self.center_x, 0), (self.center_x, self.height - 1), (255, 255, 255), 2)
+    #runs the pipeline over the region (x0, y0, x1, y1), or the whole image if region is None,
+    #and analyzes the candidates it finds.  Candidate coordinates are always full-frame.
+    def find_targets(self, region):
+        if self.settings.pyramid_scale < 1.0:
+            return self.find_targets_coarse_to_fine(region)
+        return self.find_targets_full_size(region)
+
+    def find_targets_full_size(self, region):
+        if region is None:
+            #manipulates a copy of the image to find potential vision targets in the image
+            candidate_targets, img = ImageProcessingPipeline(self.image, self.settings, timings=self.timings, buffers=self.buffers).run()
+        else:
+            x0, y0, x1, y1 = region
+            candidate_targets, roi_img = ImageProcessingPipeline(self.image[y0:y1, x0:x1], self.settings, timings=self.timings, offset=(x0, y0), buffers=self.buffers).run()
+            img = self.full_size_mask(roi_img)
+            img[y0:y1, x0:x1] = roi_img
+        return self.analyze_candidates(candidate_targets), img
+
+    #Segments and pairs the targets on a copy of the region downsampled by pyramid_scale, then runs the
+    #pipeline again at full size over just the boxes around the matched pair, so the stats keep full
+    #resolution precision while the full-frame work shrinks with the square of the scale.  If either
+    #pass comes up empty the region is searched at full size, so the pyramid never loses a target.
+    def find_targets_coarse_to_fine(self, region):
+        x0, y0, x1, y1 = (0, 0, self.width, self.height) if region is None else region
+        scale = self.settings.pyramid_scale
+        start = time.perf_counter()
+        small = cv2.resize(self.image[y0:y1, x0:x1], None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        self.record_timing("pyramid.downsample", start)
+        coarse_targets, coarse_img = ImageProcessingPipeline(small, self.settings, timings=self.timings, area_scale=scale * scale, buffers=self.buffers,
+                                                             pipeline=self.settings.coarse_pipeline).run()
+
+        start = time.perf_counter()
+        coarse = TargetAnalyzer(coarse_targets, small.shape[1], small.shape[0], self.settings.angle_error_factor)
+        left, right = coarse.best_match(coarse.find_possible_matches())
+        self.record_timing("pyramid.coarse_match", start)
+
+        if left is None:
+            return self.find_targets_full_size(region)
+
+        img = self.full_size_mask(coarse_img)
+        candidate_targets = []
+        for rx0, ry0, rx1, ry1 in self.refine_regions(left, right, scale, (x0, y0)):
+            targets, roi_img = ImageProcessingPipeline(self.image[ry0:ry1, rx0:rx1], self.settings, timings=self.timings, offset=(rx0, ry0), buffers=self.buffers).run()
+            img[ry0:ry1, rx0:rx1] = roi_img
+            candidate_targets.extend(targets)
+        target_analyzer = self.analyze_candidates(candidate_targets)
+        if not target_analyzer.success:
+            return self.find_targets_full_size(region)
+        return target_analyzer, img
+
+    #full size boxes around the coarse left and right targets - merged into one if they overlap
+    def refine_regions(self, left, right, scale, origin):
+        boxes = [self.full_size_box(target.bounding_rectangle(), scale, origin) for target in (left, right)]
+        (ax0, ay0, ax1, ay1), (bx0, by0, bx1, by1) = boxes
+        if ax0 < bx1 and bx0 < ax1 and ay0 < by1 and by0 < ay1:
+            return [(min(ax0, bx0), min(ay0, by0), max(ax1, bx1), max(ay1, by1))]
+        return boxes
+
+    def full_size_box(self, bounding_rectangle, scale, origin):
+        x, y, w, h = bounding_rectangle
+        ox, oy = origin
+        return (max(0, ox + int(math.floor((x - PYRAMID_PADDING) / scale))),
+                max(0, oy + int(math.floor((y - PYRAMID_PADDING) / scale))),
+                min(self.width, ox + int(math.ceil((x + w + PYRAMID_PADDING) / scale))),
+                min(self.height, oy + int(math.ceil((y + h + PYRAMID_PADDING) / scale))))
+
+    #analyzes candidate targets to find either a matching set of targets, or None
+    def analyze_candidates(self, candidate_targets):
+        start = time.perf_counter()
+        angles = self.calibration.at_size(self.width, self.height)
+        target_analyzer = TargetAnalyzer(candidate_targets, self.width, self.height, self.settings.angle_error_factor, angles)
+        target_analyzer.execute()
+        self.record_timing("target_analysis", start)
+        return target_analyzer
+
+    #a zeroed frame-sized image for region results to be pasted into, with the same channels as like
+    def full_size_mask(self, like):
+        shape = (self.height, self.width) + like.shape[2:]
+        if self.buffers is None:
+            return np.zeros(shape, dtype=like.dtype)
+        return self.buffers.zeros("mask", shape, like.dtype)
+
+    def record_timing(self, stage, start):
+        if self.timings is not None:
+            self.timings.record(stage, time.perf_counter() - start)
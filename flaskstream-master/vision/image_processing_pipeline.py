@@ -1,7 +1,11 @@
+import time
 import numpy as np;
 import cv2;
 from vision.vision_target import VisionTarget
+from vision.contour_features import ContourFeatureTable
+from vision.compiled_pipeline import CompiledPipeline
 
+#defaults - the values actually used come from the vision section of config.yml (see VisionSettings)
 ANALYSIS_PIPELINE = """
 gaussian_blur
 rgb_filter 0 255 218 255 0 255
@@ -13,113 +17,92 @@ MIN_AREA = 75
 MAX_AREA = 60000
 MIN_ASPECT_RATIO = 0.1
 MAX_ASPECT_RATIO = 0.8
+PYRAMID_SCALE = 1.0  #below 1, targets are found on a downsampled image first - see ImageAnalyzer.find_targets_coarse_to_fine
+CANDIDATES = "contours"  #or "components" - see find_potential_targets
+CANDIDATE_MODES = ("contours", "components")
 
 class ImageProcessingPipeline:
-    def __init__(self, image):
+    #offset is added to every contour point - used when image is a region cut out of a larger frame
+    #settings is a VisionSettings - without one the module defaults below are used
+    #area_scale multiplies the area limits - the square of the scale when image has been downsampled
+    #buffers is optional - a PipelineBuffers the steps write into instead of allocating new images
+    #pipeline is optional - a CompiledPipeline to run instead of the settings' one
+    def __init__(self, image, settings=None, timings=None, offset=(0, 0), area_scale=1.0, buffers=None, pipeline=None):
         self.image = image
+        self.timings = timings
+        self.offset = offset
+        self.area_scale = area_scale
+        self.buffers = buffers
+        self.settings = settings
+        if pipeline is not None:
+            self.pipeline = pipeline
+        else:
+            self.pipeline = settings.pipeline if settings is not None else CompiledPipeline.for_config(ANALYSIS_PIPELINE)
 
     #returns a list of potential messaing targets found in the manipulated image
     def run(self):
-        img = self.image.copy()  # we do this so we don't muck up the original image
-        pipeline = ANALYSIS_PIPELINE.splitlines()
-
-        for cmd in pipeline:
-            img = self.run_pipeline_step(img, cmd)
-
-        return (self.find_potential_targets(img), img)
-
-    def run_pipeline_step(self, img, cmd):
-        cmds = cmd.split(" ")
-        command = cmds.pop(0).strip()
-        command_fn = self.get_function_for(command.upper())
-        return command_fn(img, cmds)
-
-    def get_function_for(self, command):
-        if command == "BGR2HSL":
-            return self.convert_bgr2hsl
-        elif command == "BGR2GRAY":
-            return self.convert_bgr2gray
-        elif command == "GAUSSIAN_BLUR":
-            return self.gaussian_blur
-        elif command == "BINARY_THRESHOLD":
-            return self.binary_threshold
-        elif command == "ERODE":
-            return self.erode
-        elif command == "DILATE":
-            return self.dilate
-        elif command == "HSL_FILTER":
-            return self.apply_hsl_filter
-        elif command == "HSV_FILTER":
-            return self.apply_hsv_filter
-        elif command == "RGB_FILTER":
-            return self.apply_rgb_filter
-        return self.noop
-
-    def noop(self, img, args):
-        return img
-
-    def apply_hsl_filter(self, img, args):
-        hsl = cv2.cvtColor(img, cv2.COLOR_BGR2HLS)
-        lower = (int(args[0]), int(args[2]), int(args[4]))
-        upper = (int(args[1]), int(args[3]), int(args[5]))
-        mask = cv2.inRange(hsl, lower, upper)
-        return mask
-
-    def apply_rgb_filter(self, img, args):
-        hsl = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        lower = (int(args[0]), int(args[2]), int(args[4]))
-        upper = (int(args[1]), int(args[3]), int(args[5]))
-        mask = cv2.inRange(hsl, lower, upper)
-        return mask
-
-    def apply_hsv_filter(self, img, args):
-        hsl = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        lower = (int(args[0]), int(args[2]), int(args[4]))
-        upper = (int(args[1]), int(args[3]), int(args[5]))
-        mask = cv2.inRange(hsl, lower, upper)
-        return mask
-
-    def convert_bgr2hsl(self, img, args):
-        return cv2.cvtColor(img, cv2.COLOR_BGR2HLS)
-
-    def convert_bgr2gray(self, img, args):
-        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-    def gaussian_blur(self, img, args):
-        return cv2.GaussianBlur(img, (5, 5), 0)
-
-    def binary_threshold(self, img, args):
-        min = int(args[0])
-        max = int(args[1])
-        return cv2.threshold(img, min, max, cv2.THRESH_BINARY)[1]
-
-    def erode(self, img, args):
-        iterations = int(args[0])
-        return cv2.erode(img, None, iterations=iterations)
-
-    def dilate(self, img, args):
-        iterations = int(args[0])
-        return cv2.dilate(img, None, iterations=iterations)
-
+        img = self.image
+        for index, step in enumerate(self.pipeline):
+            img = self.run_pipeline_step(img, step, index)
+
+        if img is self.image:
+            img = self.image.copy()  # every real step writes a new image, so only copy if nothing ran
+
+        if self.timings is None:
+            return (self.find_potential_targets(img), img)
+        start = time.perf_counter()
+        targets = self.find_potential_targets(img)
+        self.timings.record("find_potential_targets", time.perf_counter() - start)
+        return (targets, img)
+
+    #each step's output has its own buffer (keyed by position in the pipeline), so a step never writes over its input
+    def run_pipeline_step(self, img, step, index=0):
+        dst = None if self.buffers is None else self.buffers.destination(index, img.shape[0], img.shape[1])
+        if self.timings is None:
+            result = step(img, dst)
+        else:
+            start = time.perf_counter()
+            result = step(img, dst)
+            self.timings.record("pipeline." + step.name, time.perf_counter() - start)
+        if self.buffers is not None and result is not dst:
+            self.buffers.keep(index, result)
+        return result
+
+    #"contours" traces every contour in the image, "components" only traces blobs that pass a quick filter first
     def find_potential_targets(self, img):
-        img, contours, _ = cv2.findContours(img,cv2.RETR_TREE,cv2.CHAIN_APPROX_SIMPLE)
+        if self.settings is not None and self.settings.candidates == "components":
+            return self.filter_and_encapsulate_contours(self.find_component_contours(img))
+        contours = cv2.findContours(img,cv2.RETR_LIST,cv2.CHAIN_APPROX_SIMPLE,offset=self.offset)[-2]  # OpenCV 3 returns 3 values, OpenCV 4 returns 2
         return self.filter_and_encapsulate_contours(contours)
 
+    #the outer contour of each connected blob that could pass the area and aspect ratio filters.  Blobs are
+    #filtered on their stats in one numpy pass, so a noisy mask's specks never get a contour traced.  A blob's
+    #bounding box is exactly its contour's, and its contour's area is always less than the box's, so nothing
+    #the full filter would keep is dropped here.  Unlike "contours", the inside edges of holes aren't candidates.
+    def find_component_contours(self, img):
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(img, connectivity=8)
+        min_area, _, min_aspect_ratio, max_aspect_ratio = self.limits()
+        widths = stats[1:, cv2.CC_STAT_WIDTH]
+        heights = stats[1:, cv2.CC_STAT_HEIGHT]
+        aspect_ratios = widths.astype(np.float64) / heights
+        keep = (widths * heights >= min_area) & (aspect_ratios >= min_aspect_ratio) & (aspect_ratios <= max_aspect_ratio)
+        contours = []
+        ox, oy = self.offset
+        for label in np.nonzero(keep)[0] + 1:
+            x, y, w, h = [int(value) for value in stats[label, :4]]
+            blob = (labels[y:y + h, x:x + w] == label).astype(np.uint8)
+            contours.extend(cv2.findContours(blob, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x + ox, y + oy))[-2])
+        return contours
+
     #this is more of a pre-filter - we're only removing things that are obviously too small or the aspect ratio of the bounding rect is way off
-    #and we return the VisionTarget (which encapsulates the contour)
+    #and we return a VisionTarget for each row of the feature table built from the surviving contours
     def filter_and_encapsulate_contours(self, contours):
-        targets = []
-        for c in contours:
-            target = VisionTarget(c)
-            if target.area() < MIN_AREA:
-                #print("Rejected contour - area too small")
-                continue
-            if target.area() > MAX_AREA:
-                #print("Rejected contour - area too large")
-                continue
-            aspect_ratio = target.bounding_box_aspect_ratio()
-            if aspect_ratio > MAX_ASPECT_RATIO or aspect_ratio < MIN_ASPECT_RATIO:
-                #print("Rejected countour - aspect_ratio of {} is outside params".format(aspect_ratio))
-                continue
-            targets.append(target)
-        return targets
+        table = ContourFeatureTable.from_contours(contours, *self.limits())
+        return [VisionTarget(table, i) for i in range(len(table))]
+
+    #(min_area, max_area, min_aspect_ratio, max_aspect_ratio) from the settings, or the module defaults without them
+    def limits(self):
+        if self.settings is None:
+            return (MIN_AREA * self.area_scale, MAX_AREA * self.area_scale, MIN_ASPECT_RATIO, MAX_ASPECT_RATIO)
+        settings = self.settings
+        return (settings.min_area * self.area_scale, settings.max_area * self.area_scale, settings.min_aspect_ratio, settings.max_aspect_ratio)
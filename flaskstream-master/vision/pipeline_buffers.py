@@ -0,0 +1,38 @@
+import numpy as np
+
+
+class PipelineBuffers:
+    """Output arrays kept from frame to frame, so the pipeline stops allocating once it's warmed up
+
+    Each pipeline step (and the full-size mask) writes into its own array, found by key.
+    A step run on a region gets a view of the top left corner of its array.  If a step
+    can't use the array it was given (a different channel count after a settings reload,
+    or a region bigger than anything seen before), whatever it allocated is kept instead.
+    Anything returned from an analysis that used these buffers is only valid until the
+    next analysis with them, so one PipelineBuffers belongs to one thread or worker.
+    """
+    def __init__(self):
+        self.arrays = {}
+
+    #returns a height x width view to write a step's output into, or None to let the step allocate
+    def destination(self, key, height, width):
+        array = self.arrays.get(key)
+        if array is None or array.shape[0] < height or array.shape[1] < width:
+            return None
+        return array[:height, :width]
+
+    def keep(self, key, result):
+        array = self.arrays.get(key)
+        if (array is None or array.shape[2:] != result.shape[2:] or array.dtype != result.dtype or
+                array.shape[0] < result.shape[0] or array.shape[1] < result.shape[1]):
+            self.arrays[key] = result
+
+    #a reused array of the given shape, zero filled
+    def zeros(self, key, shape, dtype):
+        array = self.arrays.get(key)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = np.zeros(shape, dtype=dtype)
+            self.arrays[key] = array
+        else:
+            array.fill(0)
+        return array
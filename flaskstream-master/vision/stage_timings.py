@@ -0,0 +1,18 @@
+class StageTimings:
+    """Collects how long each vision stage took, keyed by stage name
+
+    Anything with a record(stage, seconds) method can be passed to ImageAnalyzer.run
+    in place of this class to receive the same timings.
+    """
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        samples = self.samples.get(stage)
+        if samples is None:
+            samples = []
+            self.samples[stage] = samples
+        samples.append(seconds)
+
+    def stages(self):
+        return list(self.samples.keys())
@@ -1,11 +1,9 @@
-import cv2
 import numpy as np
-import itertools
+import bisect
 import math
-from vision.vision_target import VisionTarget
+from vision.vision_target import VisionTarget, ANGLE_ERROR_FACTOR
+from vision.camera_calibration import CAMERA_FOV_WIDTH_DEGREES, CAMERA_FOV_HEIGHT_DEGREES, LINEAR_CALIBRATION
 
-CAMERA_FOV_WIDTH_DEGREES = 61.179  # CODED FOR LOGITECH C920 HORIZONTAL FOV (empirical)
-CAMERA_FOV_HEIGHT_DEGREES = 43.3   # CODED FOR LOGITECH C922 VERTICAL FOV (specs)
 TARGET_GAP_INCHES = 8.0           # From FRC manual
 CAMERA_HEIGHT_INCHES = 50.2 #46.0
 TARGET_HEIGHT_ROCKET_CARGO_INCHES = 39.125
@@ -13,7 +11,10 @@ TARGET_HEIGHT_STANDARD_INCHES = 31.5
 
 
 class TargetAnalyzer:
-    def __init__(self, candidate_targets, image_width, image_height):
+    #angles is the camera's AngleTables for this image size - the linear field of view model if not given
+    def __init__(self, candidate_targets, image_width, image_height, angle_error_factor=ANGLE_ERROR_FACTOR, angles=None):
+        self.angle_error_factor = angle_error_factor
+        self.angles = angles if angles is not None else LINEAR_CALIBRATION.at_size(image_width, image_height)
         self.image_width = image_width
         self.image_height = image_height
         self.candidate_targets = candidate_targets
@@ -27,12 +28,7 @@ class TargetAnalyzer:
         self.success = False
 
     def execute(self):
-        possible_matches = []
-        for one, two in itertools.combinations(self.candidate_targets, 2):
-            if self.check_for_match(one, two) == True:
-                possible_matches.append((one, two))
-            elif self.check_for_match(two, one) == True:
-                possible_matches.append((two, one))
+        possible_matches = self.find_possible_matches()
 
         if len(possible_matches) == 0:
             self.success = False
@@ -69,27 +65,29 @@ class TargetAnalyzer:
             y = y2
         return y
 
+    #the top corner of whichever target reaches higher in the image
+    def target_top_point(self):
+        left = self.left_target.top_point()
+        right = self.right_target.top_point()
+        return right if right[1] < left[1] else left
+
+    #heading and distances are worked out from just the few matched points, undistorted, and the angle tables
     def calculate_heading(self):
         if self.left_target is None or self.right_target is None:
             return None
-        target_x = self.target_pair_center_x()
-        center_x = self.image_width / 2
-        if target_x == center_x:
-            return 0.0
-        pixels_off = abs(center_x - target_x)
-        heading_abs = CAMERA_FOV_WIDTH_DEGREES * float(pixels_off) / self.image_width
-        if target_x < center_x:
-            return heading_abs * -1.0
-        else:
-            return heading_abs
+        _, ly = self.left_target.center_point()
+        _, ry = self.right_target.center_point()
+        x, _ = self.angles.undistort([(self.target_pair_center_x(), (ly + ry) / 2.0)])[0]
+        return self.angles.heading_degrees(x)
 
     def calculate_distance_from_target_gap(self):
         if self.left_target == None or self.right_target == None:
             return None
         left = self.left_target.rotated_rectangle_points()[0][3]   #inner top point on left target
         right = self.right_target.rotated_rectangle_points()[0][1] #inner top point on right target
-        target_gap_pixels = right[0] - left[0]  #NOTE:  Should we use the point distance algorithm here, or is x-diff good enough?
-        theta = CAMERA_FOV_WIDTH_DEGREES * target_gap_pixels / self.image_width # angle in degrees of target gap in picture
+        left, right = self.angles.undistort([left, right])
+        #NOTE:  Should we use the point distance algorithm here, or is x-diff good enough?
+        theta = self.angles.heading_degrees(right[0]) - self.angles.heading_degrees(left[0]) # angle in degrees of target gap in picture
         distance_by_triangle = (TARGET_GAP_INCHES / 2) / math.tan(math.radians(theta / 2))
         return distance_by_triangle
 
@@ -97,7 +95,8 @@ class TargetAnalyzer:
         top_y = self.target_top_y()
         center_y = self.image_height / 2
         offset_in_pixels = center_y - top_y
-        vertical_angle = (offset_in_pixels * CAMERA_FOV_HEIGHT_DEGREES) / self.image_height
+        _, y = self.angles.undistort([self.target_top_point()])[0]
+        vertical_angle = self.angles.elevation_degrees(y)
         print("Pixel offset: {}".format(offset_in_pixels))
         print("vertical angle: {}".format(vertical_angle))
         if target_is_rocket_cargo == True:
@@ -110,16 +109,59 @@ class TargetAnalyzer:
         distance = abs(inches_offset / (math.tan(math.radians(vertical_angle))))
         return distance
 
+    #Pairs each potential left target with every valid right partner, for best_match to choose between.  A
+    #partner can't lie beyond the next left target at the same height - anything past it belongs to that
+    #target, and pairing across two targets would span the gap between them.  Candidates are split once by
+    #angle, lefts are swept in order of their right edge and rights in order of x, so the right-hand
+    #pointer only ever moves forward instead of testing every combination both ways.
+    def find_possible_matches(self):
+        lefts = [t for t in self.candidate_targets if t.is_potential_left_target(self.angle_error_factor)]
+        rights = [t for t in self.candidate_targets if t.is_potential_right_target(self.angle_error_factor)]
+        if len(lefts) == 0 or len(rights) == 0:
+            return []
+        lefts.sort(key=lambda t: t.bounding_rectangle()[0] + t.bounding_rectangle()[2])
+        rights.sort(key=lambda t: t.bounding_rectangle()[0])
+        right_xs = [t.bounding_rectangle()[0] for t in rights]
+        next_lefts = sorted(lefts, key=lambda t: t.bounding_rectangle()[0])
+        next_left_xs = [t.bounding_rectangle()[0] for t in next_lefts]
+
+        possible_matches = []
+        first_right = 0
+        for left in lefts:
+            lx, ly, lw, lh = left.bounding_rectangle()
+            # right can't be more leftward than the right edge of the left target
+            first_right = bisect.bisect_left(right_xs, lx + lw, first_right)
+            limit = self.next_left_x(left, next_lefts, next_left_xs)
+            for i in range(first_right, len(rights)):
+                right = rights[i]
+                rx, ry, _, rh = right.bounding_rectangle()
+                if rx >= limit: break  # right belongs to the next target over
+                if ry > (ly + lh): continue  # right can't be completely below left
+                if (ry + rh) < ly: continue  # right can't be completely above left
+                possible_matches.append((left, right))
+        return possible_matches
+
+    #x of the nearest left target starting past this one's right edge that overlaps it vertically
+    def next_left_x(self, left, next_lefts, next_left_xs):
+        lx, ly, lw, lh = left.bounding_rectangle()
+        for i in range(bisect.bisect_left(next_left_xs, lx + lw), len(next_lefts)):
+            nx, ny, _, nh = next_lefts[i].bounding_rectangle()
+            if ny <= (ly + lh) and (ny + nh) >= ly:
+                return nx
+        return math.inf
+
     def best_match(self, possible_matches):
         if len(possible_matches) == 0:
             return (None, None)
-        #TODO:  Replace this with code that can pick between multiple possible match pairs
-        return possible_matches[0]
+        return max(possible_matches, key=self.score_match)
 
-    def check_for_match(self, left, right):
-        if not(left.is_potential_left_target()): return False
-        if not(right.is_potential_matching_right_target(left)): return False
-        return True
+    #bigger pairs are closer to the robot; ties go to the pair nearest the middle of the image
+    def score_match(self, match):
+        left, right = match
+        lx, _ = left.center_point()
+        rx, _ = right.center_point()
+        center_offset = abs((lx + rx) / 2.0 - self.image_width / 2.0)
+        return (left.area() + right.area(), -center_offset)
 
     def report(self, report_no_match=False):
         lines = []
@@ -144,16 +186,3 @@ class TargetAnalyzer:
             return [self.success, self.target_pair_center_x(), self.target_top_y(), self.target_heading, self.target_distance_from_target_gap, self.target_distance_from_vertical_rocket_cargo, self.target_distance_from_vertical]
         else:
             return [self.success]
-
-    def draw_targets(self, img):
-        if self.success == True:
-            for target in [self.left_target, self.right_target]:
-                if target == None: continue
-
-                #Draw the rotated rect around the targets
-                cv2.drawContours(img, target.rotated_rectangle_points(), 0, (0,255,0), 5)
-
-                #Draw a vertical line to show the center point between the two targets
-                x = self.target_center_x
-                cv2.line(img, (x, 0), (x, self.image_height - 1), (0, 255, 0), 2)
-
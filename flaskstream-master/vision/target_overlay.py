@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+
+
+class TargetOverlay:
+    """The centerline and matched targets ImageAnalyzer found, to be drawn on a frame later
+
+    Keeping the overlay separate from the pixels means the captured image is never
+    modified, and the overlay can be drawn on whatever copy is actually shown - e.g.
+    the downscaled stream image - at that image's scale, or sent to the viewer to draw
+    (see as_dict).
+    """
+    def __init__(self, target_analyzer, width, height):
+        self.width = width
+        self.height = height
+        self.boxes = []
+        self.target_center_x = None
+        self.heading = None
+        self.distance = None
+        if target_analyzer.success == True:
+            self.boxes = [target.rotated_rectangle_points()[0] for target in [target_analyzer.left_target, target_analyzer.right_target] if target != None]
+            self.target_center_x = target_analyzer.target_center_x
+            self.heading = target_analyzer.target_heading
+            self.distance = target_analyzer.target_distance_from_target_gap
+
+    #image may be a resized copy of the analyzed frame - everything is scaled to fit it
+    def draw(self, image):
+        scale = float(image.shape[1]) / self.width
+        height = image.shape[0]
+        center_x = int(round(int(self.width / 2) * scale))
+        cv2.line(image, (center_x, 0), (center_x, height - 1), (255, 255, 255), self._thickness(2, scale))
+        for box in self.boxes:
+            #Draw the rotated rect around the targets
+            cv2.drawContours(image, [np.intp(np.round(box * scale))], 0, (0, 255, 0), self._thickness(5, scale))
+
+            #Draw a vertical line to show the center point between the two targets
+            x = int(round(self.target_center_x * scale))
+            cv2.line(image, (x, 0), (x, height - 1), (0, 255, 0), self._thickness(2, scale))
+
+    #plain values for JSON - coordinates are pixels in the analyzed frame, which is width x height
+    def as_dict(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "center_x": int(self.width / 2),
+            "targets": [box.tolist() for box in self.boxes],
+            "target_center_x": None if self.target_center_x is None else int(self.target_center_x),
+            "heading": None if self.heading is None else float(self.heading),
+            "distance": None if self.distance is None else float(self.distance),
+        }
+
+    def _thickness(self, thickness, scale):
+        return max(1, int(round(thickness * scale)))
@@ -0,0 +1,44 @@
+ROI_MARGIN = 0.5            # grow the last pair's bounding box by this fraction of its size on every side
+FULL_SEARCH_INTERVAL = 10   # search the whole frame at least this often, even while tracking
+
+
+class TargetTracker:
+    """Remembers where the last target pair was matched, across frames from one camera
+
+    After a match, ImageAnalyzer only runs the pipeline on an expanded region around
+    the last left/right targets.  Tracking is dropped on a miss, and every
+    FULL_SEARCH_INTERVAL frames the whole image is searched anyway so a closer pair
+    elsewhere in the frame can't be missed for long.
+    """
+    def __init__(self, margin=ROI_MARGIN, full_search_interval=FULL_SEARCH_INTERVAL):
+        self.margin = margin
+        self.full_search_interval = full_search_interval
+        self.roi = None
+        self.frames_since_full_search = 0
+        self.roi_frames = 0
+        self.full_frames = 0
+
+    #returns (x0, y0, x1, y1) to search, or None to search the whole frame
+    def search_region(self):
+        if self.roi is None or self.frames_since_full_search >= self.full_search_interval:
+            self.frames_since_full_search = 0
+            self.full_frames += 1
+            return None
+        self.frames_since_full_search += 1
+        self.roi_frames += 1
+        return self.roi
+
+    def update(self, target_analyzer):
+        if not target_analyzer.success:
+            self.roi = None
+            return
+        lx, ly, lw, lh = target_analyzer.left_target.bounding_rectangle()
+        rx, ry, rw, rh = target_analyzer.right_target.bounding_rectangle()
+        x0 = min(lx, rx)
+        y0 = min(ly, ry)
+        x1 = max(lx + lw, rx + rw)
+        y1 = max(ly + lh, ry + rh)
+        grow_x = int((x1 - x0) * self.margin)
+        grow_y = int((y1 - y0) * self.margin)
+        self.roi = (max(0, x0 - grow_x), max(0, y0 - grow_y),
+                    min(target_analyzer.image_width, x1 + grow_x), min(target_analyzer.image_height, y1 + grow_y))
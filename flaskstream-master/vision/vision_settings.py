@@ -0,0 +1,59 @@
+from vision.compiled_pipeline import CompiledPipeline
+from vision.image_processing_pipeline import ANALYSIS_PIPELINE, MIN_AREA, MAX_AREA, MIN_ASPECT_RATIO, MAX_ASPECT_RATIO, PYRAMID_SCALE, CANDIDATES, CANDIDATE_MODES
+from vision.vision_target import ANGLE_ERROR_FACTOR
+
+DEFAULTS = {
+    "pipeline": ANALYSIS_PIPELINE,
+    "min_area": MIN_AREA,
+    "max_area": MAX_AREA,
+    "min_aspect_ratio": MIN_ASPECT_RATIO,
+    "max_aspect_ratio": MAX_ASPECT_RATIO,
+    "angle_error_factor": ANGLE_ERROR_FACTOR,
+    "pyramid_scale": PYRAMID_SCALE,
+    "candidates": CANDIDATES,
+}
+
+
+class VisionSettings:
+    """The tunable vision values from the config.yml vision section, with the pipeline compiled
+
+    Settings are never modified in place.  A change builds (and compiles) a whole new
+    VisionSettings, which is then swapped in with a single assignment, so a frame always
+    sees one consistent set of values and a bad pipeline fails before it's swapped in.
+    """
+    @classmethod
+    def from_config(cls, values):
+        config = dict(DEFAULTS)
+        unknown = set((values or {}).keys()) - set(DEFAULTS.keys())
+        if len(unknown) > 0:
+            raise ValueError("Unknown vision settings: {}".format(", ".join(sorted(unknown))))
+        config.update(values or {})
+        return VisionSettings(config)
+
+    def __init__(self, config):
+        self.config = config
+        self.pipeline = CompiledPipeline.for_config(config["pipeline"])
+        self.min_area = float(config["min_area"])
+        self.max_area = float(config["max_area"])
+        self.min_aspect_ratio = float(config["min_aspect_ratio"])
+        self.max_aspect_ratio = float(config["max_aspect_ratio"])
+        self.angle_error_factor = float(config["angle_error_factor"])
+        self.pyramid_scale = float(config["pyramid_scale"])
+        if self.pyramid_scale <= 0.0 or self.pyramid_scale > 1.0:
+            raise ValueError("pyramid_scale must be greater than 0 and at most 1, not {}".format(self.pyramid_scale))
+        #the pipeline for the downsampled image - erode and dilate shrink with it, or they wipe out distant targets
+        self.coarse_pipeline = CompiledPipeline.for_config(config["pipeline"], self.pyramid_scale)
+        self.candidates = str(config["candidates"])
+        if self.candidates not in CANDIDATE_MODES:
+            raise ValueError("candidates must be one of {}, not {}".format(", ".join(CANDIDATE_MODES), self.candidates))
+
+    #returns a new VisionSettings with one value changed
+    def with_value(self, key, value):
+        if key not in DEFAULTS:
+            raise ValueError("Unknown vision setting: {}".format(key))
+        config = dict(self.config)
+        config[key] = value
+        return VisionSettings(config)
+
+
+DEFAULT_SETTINGS = VisionSettings(dict(DEFAULTS))
@@ -0,0 +1,233 @@
+import ctypes
+import os
+import multiprocessing
+import multiprocessing.connection
+import threading
+import time
+import numpy as np
+import cv2
+from vision.image_analyzer import ImageAnalyzer
+from vision.pipeline_buffers import PipelineBuffers
+from vision.stage_timings import StageTimings
+from vision.target_tracker import TargetTracker
+from vision.vision_settings import VisionSettings
+
+PARENT_CHECK_SECONDS = 1.0  #how often an idle worker checks that the process that started it is still there
+
+
+class SharedFrameSlots:
+    """Preallocated image buffers in shared memory
+
+    The buffers are created before the workers are forked, so parent and workers see
+    the same memory and frames are handed over by slot number instead of being pickled.
+    """
+    def __init__(self, count, shape):
+        size = int(np.prod(shape))
+        self.buffers = [multiprocessing.RawArray(ctypes.c_uint8, size) for _ in range(count)]
+        self.arrays = [np.frombuffer(buffer, dtype=np.uint8).reshape(shape) for buffer in self.buffers]
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def __getitem__(self, slot):
+        return self.arrays[slot]
+
+
+#tasks and results are this worker's own pipe ends - a shared queue stays locked if a worker dies while reading it
+#parent_ends are the pool's ends of every pipe made so far, inherited by the fork - closing them means tasks
+#reads EOF once the pool's process is gone.  Anything else forked later still holds them, so the worker
+#also exits when it's been handed over to a new parent.
+def _worker_main(role, images, masks, tasks, results, calibration, parent_ends, parent_pid):
+    for end in parent_ends:
+        end.close()
+    cv2.setNumThreads(1)  #the pool provides the parallelism
+    tracker = TargetTracker()  #each worker tracks the frames it happens to see
+    buffers = PipelineBuffers()
+    settings = None
+    while True:
+        if not tasks.poll(PARENT_CHECK_SECONDS):
+            if os.getppid() != parent_pid:
+                break
+            continue
+        try:
+            task = tasks.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        slot, sequence, settings_config, keep_processed = task
+        timings = StageTimings()
+        try:
+            if settings is None or settings.config != settings_config:
+                settings = VisionSettings(settings_config)
+            #the overlay goes back with the stats - the camera draws it on the stream image
+            analyzer = ImageAnalyzer(images[slot], role, timings, tracker, settings, calibration, buffers=buffers, annotate=False)
+            _, stats, processed, _ = analyzer.execute()
+            has_mask = keep_processed and processed is not None and processed.shape == masks[slot].shape
+            if has_mask:
+                np.copyto(masks[slot], processed)
+            results.send((slot, sequence, stats, analyzer.overlay, has_mask, timings.samples, None))
+        except Exception as error:
+            results.send((slot, sequence, None, None, False, timings.samples, str(error)))
+
+
+class VisionWorkerPool:
+    """Runs ImageAnalyzer for one camera across several processes
+
+    submit() copies a CameraFrame into a free shared-memory slot and hands the slot to
+    a worker.  Results are delivered to on_result in capture order: a result that
+    finishes after a newer frame has already been delivered is dropped as stale.
+    The frame is retained while it's in the pool, since its image is streamed later.
+    Each slot goes to the worker with the fewest in hand, so when a worker dies its
+    slots and frames are given back.  Once none are left submit() refuses every frame,
+    and the camera analyzes them itself.
+    Create the pool before starting any other threads - the workers are forked.
+    """
+    def __init__(self, role, shape, workers, on_result, metrics=None, calibration=None):
+        self.role = role
+        self.on_result = on_result
+        self.metrics = metrics
+        slot_count = workers * 2
+        self.images = SharedFrameSlots(slot_count, shape)
+        self.masks = SharedFrameSlots(slot_count, shape[:2])
+        self.free_slots = list(range(slot_count))
+        self.pending = {}
+        self.last_delivered = 0
+        self.condition = threading.Condition()
+
+        context = multiprocessing.get_context("fork")
+        self.workers = []
+        self.tasks = []
+        self.results = []
+        self.alive = set()
+        for index in range(workers):
+            task_reader, task_writer = context.Pipe(duplex=False)
+            result_reader, result_writer = context.Pipe(duplex=False)
+            parent_ends = self.tasks + self.results + [task_writer, result_reader]
+            worker = context.Process(target=_worker_main, args=(role, self.images, self.masks, task_reader, result_writer, calibration, parent_ends, os.getpid()))
+            worker.daemon = True
+            worker.start()
+            task_reader.close()
+            result_writer.close()
+            self.workers.append(worker)
+            self.tasks.append(task_writer)
+            self.results.append(result_reader)
+            self.alive.add(index)
+
+        self.collector = threading.Thread(target=self._collect_results)
+        self.collector.daemon = True
+        self.collector.start()
+
+    #also returns once every worker has died, so the caller goes on without the pool
+    def wait_for_free_slot(self):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.free_slots) > 0 or len(self.alive) == 0)
+
+    #returns False if every slot is busy, or the frame doesn't fit the slots, and the frame was not submitted
+    #settings (a VisionSettings) travel with each frame as a small dict, so a reload reaches every worker
+    #keep_processed asks for the pipeline's mask back in frame.processed, e.g. for a snapshot
+    def submit(self, frame, settings, keep_processed=False):
+        if frame.image.shape != self.images[0].shape:
+            return False
+        with self.condition:
+            if len(self.free_slots) == 0 or len(self.alive) == 0:
+                return False
+            slot = self.free_slots.pop()
+            index = min(self.alive, key=self._slots_held)
+            frame.retain()
+            self.pending[slot] = (frame, time.perf_counter(), index)
+        np.copyto(self.images[slot], frame.image)
+        try:
+            self.tasks[index].send((slot, frame.sequence, settings.config, keep_processed))
+        except OSError:
+            pass  #the worker is gone - the collector gives its slots back
+        return True
+
+    def close(self):
+        for index in sorted(self.alive):
+            try:
+                self.tasks[index].send(None)
+            except OSError:
+                pass
+        for worker in self.workers:
+            worker.join(timeout=1.0)
+
+    def _slots_held(self, index):
+        return sum(1 for entry in self.pending.values() if entry[2] == index)
+
+    #a worker's sentinel is ready once its process has ended
+    def _collect_results(self):
+        readers = {}
+        for index in range(len(self.workers)):
+            readers[self.results[index]] = index
+            readers[self.workers[index].sentinel] = index
+        while len(readers) > 0:
+            for ready in multiprocessing.connection.wait(list(readers.keys())):
+                index = readers[ready]
+                if ready is self.results[index]:
+                    try:
+                        result = ready.recv()
+                    except EOFError:
+                        result = None
+                    if result is not None:
+                        self._deliver(result)
+                        continue
+                #results it sent before it died still count
+                while self.results[index].poll():
+                    try:
+                        self._deliver(self.results[index].recv())
+                    except EOFError:
+                        break
+                self._worker_died(index)
+                readers.pop(self.results[index], None)
+                readers.pop(self.workers[index].sentinel, None)
+
+    def _worker_died(self, index):
+        worker = self.workers[index]
+        worker.join(timeout=1.0)
+        with self.condition:
+            self.alive.discard(index)
+            slots = [slot for slot, entry in self.pending.items() if entry[2] == index]
+            frames = [self.pending.pop(slot)[0] for slot in slots]
+            self.free_slots.extend(slots)
+            self.condition.notify_all()
+        for frame in frames:
+            frame.release()
+        if worker.exitcode != 0:
+            print("vision worker {} for {} camera died (exit code {}) - {} frames given back".format(index, self.role, worker.exitcode, len(frames)))
+
+    def _deliver(self, result):
+        slot, sequence, stats, overlay, has_mask, samples, error = result
+        with self.condition:
+            frame, submitted, _ = self.pending.pop(slot)
+        if error is not None:
+            print(error)
+            print("exception in vision worker")
+        elif sequence <= self.last_delivered:
+            #a newer frame was already delivered - this one is stale
+            if self.metrics is not None:
+                self.metrics.mark_dropped()
+        else:
+            self.last_delivered = sequence
+            frame.overlay = overlay
+            frame.processed = np.copy(self.masks[slot]) if has_mask else None
+            frame.stats = stats
+        self._release(slot)
+        if frame.stats is not None:
+            if self.metrics is not None:
+                for stage, seconds in samples.items():
+                    for sample in seconds:
+                        self.metrics.record(stage, sample)
+                self.metrics.for_frame(frame).record("process_frame", time.perf_counter() - submitted)
+            try:
+                self.on_result(frame)
+            except Exception as error:
+                #the collector must outlive a bad result, or every later frame is stuck in the pool
+                print(error)
+                print("exception delivering a vision result")
+        frame.release()
+
+    def _release(self, slot):
+        with self.condition:
+            self.free_slots.append(slot)
+            self.condition.notify()